@@ -1,14 +1,35 @@
 import streamlit as st
 import nest_asyncio
+import json
+import logging
+import math
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from hashlib import md5
 from io import BytesIO
+from typing import Callable, Dict, List, Optional
+from phi.document import Document
 from phi.assistant import Assistant
 from phi.document.reader.pdf import PDFReader
 from phi.llm.openai import OpenAIChat
 from phi.knowledge import AssistantKnowledge
 from phi.tools.duckduckgo import DuckDuckGo
 from phi.embedder.openai import OpenAIEmbedder
+from phi.vectordb.distance import Distance
 from phi.vectordb.pgvector import PgVector2
+from phi.vectordb.pgvector.index import HNSW, Ivfflat
 from phi.storage.assistant.postgres import PgAssistantStorage
+from phi.assistant.run import AssistantRun
+from phi.llm.message import Message
+from sqlalchemy import BigInteger, Column, DateTime, Identity, Index, String, Table, insert, select, text, tuple_
+from sqlalchemy.dialects import postgresql
+
+logger = logging.getLogger(__name__)
 
 # Apply nest_asyncio to allow nested event loops, required for running async functions in Streamlit
 nest_asyncio.apply()
@@ -16,27 +37,192 @@ nest_asyncio.apply()
 # Database connection string for PostgreSQL
 DB_URL = "postgresql+psycopg://ai:ai@localhost:5532/ai"
 
+# Background ingestion settings
+INGEST_WORKERS = 2  # PDFs processed at the same time, shared by all sessions
+EMBED_BATCH_SIZE = 100  # chunks per OpenAI embeddings request
+EMBED_CONCURRENCY = 4  # embeddings requests in flight per PDF
+WRITE_BATCH_SIZE = 500  # rows per COPY into PgVector
+
+# Vector index settings. IVFFlat learns its lists from existing rows, so it is only built once
+# the collection has IVFFLAT_MIN_ROWS rows; HNSW can be built on an empty table and kept up to date.
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "hnsw")  # "hnsw", "ivfflat" or "exact"
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 64
+HNSW_EF_SEARCH = 40  # must be at least the number of documents retrieved
+IVFFLAT_PROBES = 10
+IVFFLAT_MIN_ROWS = 1000
+INDEX_MAINTENANCE_WORK_MEM = os.getenv("INDEX_MAINTENANCE_WORK_MEM", "512MB")
+
+# Answer streaming settings
+RENDER_INTERVAL = 0.1  # seconds between updates of the streamed answer
+
+# Chat history settings: the run row keeps only a window of recent exchanges; older ones are
+# archived a message per row and folded into a running summary
+HISTORY_WINDOW_CHATS = int(os.getenv("HISTORY_WINDOW_CHATS", "10"))  # user/assistant exchanges kept in the run row
+if HISTORY_WINDOW_CHATS < 1:
+    raise ValueError(f"HISTORY_WINDOW_CHATS must be at least 1, got {HISTORY_WINDOW_CHATS}")
+HISTORY_COMPACT_EVERY = 5  # compact once this many exchanges have accumulated beyond the window
+REFERENCES_WINDOW = 10  # knowledge base references kept in the run row
+HISTORY_PAGE_SIZE = 20  # archived messages per page
+
+class BoundedPgAssistantStorage(PgAssistantStorage):
+    """
+    PgAssistantStorage that keeps each run row bounded, so reading and rewriting it on every
+    interaction stays cheap however long the session runs. Exchanges beyond the window move to
+    an archive table indexed by (run_id, created_at) and are summarised in the background.
+    """
+
+    def __init__(self, table_name: str, db_url: str, summarize: Optional[Callable[[str, str], str]] = None, **kwargs):
+        super().__init__(table_name=table_name, db_url=db_url, **kwargs)
+        self.summarize = summarize
+        self.archive = Table(
+            f"{table_name}_archive",
+            self.metadata,
+            Column("id", BigInteger, Identity(), primary_key=True),
+            Column("run_id", String, nullable=False),
+            Column("role", String),  # message role, or "summary" for a running summary
+            Column("message", postgresql.JSONB),
+            Column("created_at", DateTime(timezone=True), server_default=text("now()")),
+            Index(f"{table_name}_archive_run_created_idx", "run_id", "created_at", "id"),
+            extend_existing=True,
+        )
+        self.summary_executor = ThreadPoolExecutor(max_workers=1)  # one at a time keeps summaries in order
+
+    def create(self) -> None:
+        super().create()
+        self.archive.create(self.db_engine, checkfirst=True)
+
+    def upsert(self, row: AssistantRun) -> Optional[AssistantRun]:
+        memory = row.memory or {}
+        chat_history = memory.get("chat_history", [])
+        user_turns = [i for i, message in enumerate(chat_history) if message.get("role") == "user"]
+        if len(user_turns) > HISTORY_WINDOW_CHATS + HISTORY_COMPACT_EVERY:
+            cut = user_turns[-HISTORY_WINDOW_CHATS]
+            archived = chat_history[:cut]
+            memory["chat_history"] = chat_history[cut:]
+            # llm_messages hold every prompt, tool call and tool result, so they are dropped rather than archived
+            llm_messages = memory.get("llm_messages", [])
+            llm_user_turns = [i for i, message in enumerate(llm_messages) if message.get("role") == "user"]
+            if len(llm_user_turns) > HISTORY_WINDOW_CHATS:
+                memory["llm_messages"] = llm_messages[llm_user_turns[-HISTORY_WINDOW_CHATS]:]
+            self.archive_messages(row.run_id, archived)
+            if self.summarize:
+                self.summary_executor.submit(self.update_summary, row.run_id, archived)
+        memory["references"] = memory.get("references", [])[-REFERENCES_WINDOW:]
+        row.memory = memory
+        return super().upsert(row)
+
+    def archive_messages(self, run_id: str, messages: List[Dict]):
+        rows = [{"run_id": run_id, "role": message.get("role"), "message": message} for message in messages]
+        try:
+            self.write_archive(rows)
+        except Exception as e:
+            # The run table may predate the archive table
+            logger.warning(f"Archiving {len(rows)} messages of run {run_id} failed, creating the archive table: {e!r}")
+            self.create()
+            self.write_archive(rows)
+
+    def write_archive(self, rows: List[Dict]):
+        with self.Session() as sess, sess.begin():
+            sess.execute(insert(self.archive), rows)
+
+    def read_summary(self, run_id: str) -> str:
+        """Latest running summary of the archived exchanges, if any."""
+        stmt = (select(self.archive.c.message).where(self.archive.c.run_id == run_id, self.archive.c.role == "summary")
+                .order_by(self.archive.c.created_at.desc(), self.archive.c.id.desc()).limit(1))
+        try:
+            with self.Session() as sess, sess.begin():
+                message = sess.execute(stmt).scalar()
+        except Exception as e:
+            logger.warning(f"Reading the history summary of run {run_id} failed: {e!r}")
+            return ""
+        return message["content"] if message else ""
+
+    def update_summary(self, run_id: str, messages: List[Dict]):
+        transcript = "\n".join(f"{m.get('role', '').upper()}: {m.get('content')}" for m in messages
+                               if m.get("role") in ("user", "assistant") and m.get("content"))
+        # This runs on summary_executor, whose futures nobody reads, so failures have to be logged here
+        try:
+            summary = self.summarize(self.read_summary(run_id), transcript)
+            self.write_archive([{"run_id": run_id, "role": "summary", "message": {"role": "summary", "content": summary}}])
+        except Exception:
+            logger.exception(f"Updating the history summary of run {run_id} failed")
+
+    def read_history_page(self, run_id: str, before: Optional[tuple] = None, limit: int = HISTORY_PAGE_SIZE):
+        """
+        One page of archived messages, newest first. Pass the returned cursor as `before` to get the
+        next older page; the cursor is None once there are no more.
+        """
+        stmt = select(self.archive.c.id, self.archive.c.message, self.archive.c.created_at).where(
+            self.archive.c.run_id == run_id, self.archive.c.role != "summary")
+        if before is not None:
+            stmt = stmt.where(tuple_(self.archive.c.created_at, self.archive.c.id) < before)
+        stmt = stmt.order_by(self.archive.c.created_at.desc(), self.archive.c.id.desc()).limit(limit)
+        try:
+            with self.Session() as sess, sess.begin():
+                rows = sess.execute(stmt).fetchall()
+        except Exception as e:
+            logger.warning(f"Reading archived messages of run {run_id} failed: {e!r}")
+            return [], None
+        cursor = (rows[-1].created_at, rows[-1].id) if len(rows) == limit else None
+        return [row.message for row in rows], cursor
+
+def summarize_history(llm: OpenAIChat, previous_summary: str, transcript: str) -> str:
+    """Fold newly archived exchanges into the running summary of the conversation."""
+    prompt = (
+        "Update the summary of an earlier conversation between a user and an assistant with the new exchanges below. "
+        "Keep facts, names, decisions and open questions; drop pleasantries. Reply with the summary only.\n\n"
+        f"Current summary:\n{previous_summary or '(none)'}\n\nNew exchanges:\n{transcript}"
+    )
+    return llm.response(messages=[Message(role="user", content=prompt)])
+
+def make_vector_index(index_type: str):
+    """Index settings for PgVector2; None means exact (sequential scan) search."""
+    configuration = {"maintenance_work_mem": INDEX_MAINTENANCE_WORK_MEM}
+    if index_type == "hnsw":
+        return HNSW(m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, ef_search=HNSW_EF_SEARCH, configuration=configuration)
+    if index_type == "ivfflat":
+        return Ivfflat(probes=IVFFLAT_PROBES, configuration=configuration)
+    return None
+
 # Function to set up the Assistant, utilizing caching for resource efficiency
 @st.cache_resource
 def setup_assistant(api_key: str) -> Assistant:
     llm = OpenAIChat(model="gpt-4o-mini", api_key=api_key)
+    summary_llm = OpenAIChat(model="gpt-4o-mini", api_key=api_key)  # separate instance: llm carries the assistant's tools
+    storage = BoundedPgAssistantStorage(
+        table_name="auto_rag_storage",
+        db_url=DB_URL,
+        summarize=lambda previous_summary, transcript: summarize_history(summary_llm, previous_summary, transcript),
+    )
+
+    def get_conversation_summary() -> str:
+        """Use this function to get a summary of the conversation before the chats returned by get_chat_history.
+
+        Returns:
+            str: The summary, or a note that there is no earlier conversation.
+        """
+        return storage.read_summary(assistant.run_id) or "There is no earlier conversation."
+
     # Set up the Assistant with storage, knowledge base, and tools
-    return Assistant(
+    assistant = Assistant(
         name="auto_rag_assistant",  # Name of the Assistant
         llm=llm,  # Language model to be used
-        storage=PgAssistantStorage(table_name="auto_rag_storage", db_url=DB_URL),  
+        storage=storage,  # Keeps only recent history in the run row; older chats are archived and summarised
         knowledge_base=AssistantKnowledge(
             vector_db=PgVector2(
                 db_url=DB_URL,  
                 collection="auto_rag_docs",  
                 embedder=OpenAIEmbedder(model="text-embedding-ada-002", dimensions=1536, api_key=api_key),  
+                index=make_vector_index(VECTOR_INDEX_TYPE),  
             ),
             num_documents=3,  
         ),
-        tools=[DuckDuckGo()],  # Additional tool for web search via DuckDuckGo
+        tools=[DuckDuckGo(), get_conversation_summary],  # Web search via DuckDuckGo, and older chat history
         instructions=[
             "Search your knowledge base first.",  
             "If not found, search the internet.",  
+            "For earlier parts of the conversation, use get_chat_history and then get_conversation_summary.",  
             "Provide clear and concise answers.",  
         ],
         show_tool_calls=True,  
@@ -45,20 +231,277 @@ def setup_assistant(api_key: str) -> Assistant:
         markdown=True,  
         debug_mode=True,  
     )
+    return assistant
+
+@dataclass
+class IngestionJob:
+    """Status of one PDF being added to the knowledge base, polled by the UI."""
+    file_name: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex[:8])
+    status: str = "queued"  # queued -> reading -> embedding -> [indexing] -> done | failed
+    total_chunks: int = 0
+    embedded_chunks: int = 0
+    written_chunks: int = 0
+    error: Optional[str] = None
+    submitted_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+class IngestionQueue:
+    """Runs PDF ingestion on background threads so the Streamlit script never blocks on embeddings."""
+
+    def __init__(self, num_workers: int = INGEST_WORKERS):
+        self.jobs: Dict[str, IngestionJob] = {}
+        self._queue: queue.Queue = queue.Queue()
+        for _ in range(num_workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def submit(self, vector_db: PgVector2, file_name: str, data: bytes) -> IngestionJob:
+        job = IngestionJob(file_name=file_name)
+        self.jobs[job.id] = job
+        self._queue.put((job, vector_db, data))
+        return job
 
-# Function to add a PDF document to the knowledge base
-def add_document(assistant: Assistant, file: BytesIO):
-    reader = PDFReader()
-    docs = reader.read(file)
-    if docs:
-        assistant.knowledge_base.load_documents(docs, upsert=True)
-        st.success("Document added to the knowledge base.")
-    else:
-        st.error("Failed to read the document.")
+    def _work(self):
+        while True:
+            job, vector_db, data = self._queue.get()
+            try:
+                ingest_pdf(job, vector_db, data)
+                job.status = "done"
+            except Exception as e:
+                job.status, job.error = "failed", str(e)
+            finally:
+                job.finished_at = time.time()
 
-# Function to query the Assistant and return a response
-def query_assistant(assistant: Assistant, question: str) -> str:
-    return "".join([delta for delta in assistant.run(question)])
+@st.cache_resource
+def get_ingestion_queue() -> IngestionQueue:
+    """One queue per process, shared by every session."""
+    return IngestionQueue()
+
+def embed_batch(vector_db: PgVector2, client, docs: List[Document]) -> List[List[float]]:
+    """Embed a batch of chunks with a single OpenAI embeddings request."""
+    embedder = vector_db.embedder
+    params = {"input": [doc.content for doc in docs], "model": embedder.model, "encoding_format": "float"}
+    if embedder.model.startswith("text-embedding-3"):
+        params["dimensions"] = embedder.dimensions
+    response = client.embeddings.create(**params)
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+def vector_table(vector_db: PgVector2) -> str:
+    return f"{vector_db.schema}.{vector_db.collection}" if vector_db.schema else vector_db.collection
+
+def ivfflat_lists(num_rows: int) -> int:
+    """pgvector's guidance: rows / 1000 lists up to 1M rows, sqrt(rows) beyond."""
+    return max(1, num_rows // 1000) if num_rows <= 1_000_000 else int(math.sqrt(num_rows))
+
+def vector_index_status(vector_db: PgVector2) -> List[Dict]:
+    """List the ANN indexes on the collection, with their size and whether they are valid."""
+    if not vector_db.table_exists():
+        return []
+    with vector_db.db_engine.connect() as conn:
+        rows = conn.exec_driver_sql(
+            "SELECT c.relname AS name, am.amname AS method, i.indisvalid AS valid, pg_relation_size(c.oid) AS size_bytes "
+            "FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid JOIN pg_am am ON am.oid = c.relam "
+            "WHERE i.indrelid = %(table)s::regclass AND am.amname IN ('hnsw', 'ivfflat')",
+            {"table": vector_table(vector_db)},
+        )
+        return [dict(row._mapping) for row in rows]
+
+index_build_lock = threading.Lock()  # one index build at a time from this process
+
+def build_vector_index(vector_db: PgVector2, rebuild: bool = False) -> str:
+    """
+    Create the collection's ANN index if it is missing. With rebuild, drop every existing ANN index
+    first, e.g. after switching index type or once an IVFFlat index has been trained on too few rows.
+    """
+    vector_db.create()
+    index = vector_db.index
+    kind = "hnsw" if isinstance(index, HNSW) else "ivfflat" if isinstance(index, Ivfflat) else None
+    num_rows = vector_db.get_count()
+    if kind == "ivfflat" and num_rows < IVFFLAT_MIN_ROWS:
+        return f"IVFFlat needs at least {IVFFLAT_MIN_ROWS} rows to train its lists; the collection has {num_rows}."
+    ops = {Distance.cosine: "vector_cosine_ops", Distance.l2: "vector_l2_ops",
+           Distance.max_inner_product: "vector_ip_ops"}[vector_db.distance]
+    params = f"m = {index.m}, ef_construction = {index.ef_construction}" if kind == "hnsw" else f"lists = {ivfflat_lists(num_rows)}"
+    # CONCURRENTLY keeps the table readable and writable during the build, but cannot run inside a transaction.
+    schema = f"{vector_db.schema}." if vector_db.schema else ""
+    with index_build_lock, vector_db.db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql(f"SET maintenance_work_mem = '{INDEX_MAINTENANCE_WORK_MEM}'")
+        if rebuild:
+            for existing in vector_index_status(vector_db):
+                conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {schema}{existing['name']}")
+        if kind is None:
+            return "Exact search: no ANN index is used."
+        name = f"{vector_db.collection}_{kind}_index"
+        # A failed CONCURRENTLY build leaves an invalid index behind, and IF NOT EXISTS would keep it
+        if any(index["name"] == name and not index["valid"] for index in vector_index_status(vector_db)):
+            conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {schema}{name}")
+        conn.exec_driver_sql(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {vector_table(vector_db)} "
+            f"USING {kind} (embedding {ops}) WITH ({params})"
+        )
+    if not any(index["name"] == name and index["valid"] for index in vector_index_status(vector_db)):
+        return f"{kind.upper()} index {name} is not valid; the build did not complete, try Rebuild index."
+    return f"{kind.upper()} index {name} is ready ({params}, {num_rows} rows)."
+
+def copy_rows(vector_db: PgVector2, rows: List[tuple]):
+    """
+    Bulk upsert rows into the PgVector table: COPY into a temporary staging table,
+    then a single INSERT ... ON CONFLICT, instead of one INSERT per chunk.
+    """
+    table = vector_table(vector_db)
+    columns = "id, name, meta_data, content, embedding, usage, content_hash"
+    with vector_db.db_engine.begin() as conn:
+        conn.exec_driver_sql(f"CREATE TEMP TABLE ingest_staging (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+        cursor = conn.connection.driver_connection.cursor()
+        with cursor.copy(f"COPY ingest_staging ({columns}) FROM STDIN") as copy:
+            for row in rows:
+                copy.write_row(row)
+        conn.exec_driver_sql(
+            f"INSERT INTO {table} ({columns}) SELECT {columns} FROM ingest_staging "
+            "ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name, meta_data = EXCLUDED.meta_data, "
+            "content = EXCLUDED.content, embedding = EXCLUDED.embedding, usage = EXCLUDED.usage, "
+            "content_hash = EXCLUDED.content_hash, updated_at = now()"
+        )
+
+def ingest_pdf(job: IngestionJob, vector_db: PgVector2, data: bytes):
+    """Read, chunk, embed in batches and bulk write one PDF, updating the job as it goes."""
+    job.status = "reading"
+    file = BytesIO(data)
+    file.name = job.file_name  # PDFReader names documents (and so chunk ids) after the file
+    docs = [doc for doc in PDFReader().read(file) if doc.content.strip()]
+    if not docs:
+        raise ValueError("No text could be read from the PDF.")
+    job.total_chunks = len(docs)
+    vector_db.create()
+
+    job.status = "embedding"
+    client = vector_db.embedder.client
+    batches = [docs[i:i + EMBED_BATCH_SIZE] for i in range(0, len(docs), EMBED_BATCH_SIZE)]
+    rows = []
+    with ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY) as executor:
+        for batch, embeddings in zip(batches, executor.map(lambda batch: embed_batch(vector_db, client, batch), batches)):
+            for doc, embedding in zip(batch, embeddings):
+                content = doc.content.replace("\x00", "\ufffd")
+                content_hash = md5(content.encode()).hexdigest()
+                rows.append((doc.id or content_hash, doc.name, json.dumps(doc.meta_data), content,
+                             str(embedding), None, content_hash))
+            job.embedded_chunks += len(batch)
+            if len(rows) >= WRITE_BATCH_SIZE:
+                copy_rows(vector_db, rows)
+                job.written_chunks += len(rows)
+                rows = []
+    if rows:
+        copy_rows(vector_db, rows)
+        job.written_chunks += len(rows)
+
+    indexes = vector_index_status(vector_db)
+    if vector_db.index is not None and not any(index["valid"] for index in indexes):
+        job.status = "indexing"
+        build_vector_index(vector_db, rebuild=bool(indexes))  # drop indexes left invalid by a failed build
+
+class AnswerStream:
+    """
+    Consumes the assistant's deltas on a worker thread, so the page can render them at its own pace
+    and a Stop click (which reruns the script) can cancel the run.
+    """
+
+    def __init__(self, assistant: Assistant, question: str):
+        self.question = question
+        self.text = ""
+        self.error: Optional[Exception] = None
+        self.done = threading.Event()
+        self.cancelled = threading.Event()
+        threading.Thread(target=self._run, args=(assistant, question), daemon=True).start()
+
+    def _run(self, assistant: Assistant, question: str):
+        deltas = assistant.run(question, stream=True)
+        try:
+            for delta in deltas:
+                if self.cancelled.is_set():
+                    break
+                self.text += delta
+        except Exception as e:
+            self.error = e
+        finally:
+            # Closing the generator also closes the underlying OpenAI stream. A tool call that is
+            # already running (e.g. a web search) finishes first, then the run stops.
+            deltas.close()
+            self.done.set()
+
+    def cancel(self):
+        if not self.done.is_set():
+            self.cancelled.set()
+
+# Function to query the Assistant and stream the response into a placeholder
+def query_assistant(assistant: Assistant, question: str, placeholder) -> str:
+    # A new question reruns the script while the previous answer may still be streaming. Both runs would
+    # share the assistant's memory, so stop the old one and let it finish before starting the new one.
+    previous = st.session_state.get("answer_stream")
+    if previous is not None and not previous.done.is_set():
+        previous.cancel()
+        placeholder.markdown("⏳ Stopping the previous answer...")
+        previous.done.wait()
+    stream = AnswerStream(assistant, question)
+    st.session_state.answer_stream = stream
+    placeholder.markdown("🤔 Thinking...")
+    while not stream.done.wait(RENDER_INTERVAL):
+        if stream.text:
+            placeholder.markdown(stream.text + "▌")
+    placeholder.markdown(stream.text)
+    if stream.error:
+        raise stream.error
+    return stream.text
+
+@st.fragment(run_every=2)
+def show_ingestion_jobs():
+    """Poll this session's ingestion jobs without rerunning the whole page."""
+    jobs = get_ingestion_queue().jobs
+    for job_id in st.session_state.get("ingest_job_ids", []):
+        job = jobs[job_id]
+        if job.status == "done":
+            st.success(f"{job.file_name}: {job.written_chunks} chunks added to the knowledge base.")
+        elif job.status == "failed":
+            st.error(f"{job.file_name}: {job.error}")
+        else:
+            progress = job.embedded_chunks / job.total_chunks if job.total_chunks else 0.0
+            st.progress(progress, text=f"{job.file_name}: {job.status} ({job.embedded_chunks}/{job.total_chunks} chunks)")
+
+def show_vector_index_settings(vector_db: PgVector2):
+    """Tune the query-time search breadth and build or rebuild the collection's ANN index."""
+    with st.expander("🧭 Vector index"):
+        index = vector_db.index
+        # The vector DB is shared by every session using this API key, so tuning applies to all of them.
+        if isinstance(index, HNSW):
+            index.ef_search = st.slider("hnsw.ef_search", 10, 400, index.ef_search,
+                                        help="Candidates explored per query: higher is more accurate and slower.")
+        elif isinstance(index, Ivfflat):
+            index.probes = st.slider("ivfflat.probes", 1, 100, index.probes,
+                                     help="Lists scanned per query: higher is more accurate and slower.")
+        else:
+            st.caption("Exact search (VECTOR_INDEX_TYPE=exact). Rebuild drops any existing ANN index.")
+        for status in vector_index_status(vector_db):
+            validity = "" if status["valid"] else ", invalid: rebuild it"
+            st.caption(f"{status['name']} ({status['method']}, {status['size_bytes'] / 2**20:.1f} MB{validity})")
+        col1, col2 = st.columns(2)
+        if col1.button("Build index"):
+            st.info(build_vector_index(vector_db))
+        if col2.button("Rebuild index"):
+            st.info(build_vector_index(vector_db, rebuild=True))
+
+def show_earlier_conversation(assistant: Assistant):
+    """Show the running summary and page through archived messages, newest page first."""
+    if assistant.run_id is None:
+        return
+    storage = assistant.storage
+    with st.expander("🗂️ Earlier conversation"):
+        st.markdown(storage.read_summary(assistant.run_id) or "Nothing has been archived yet.")
+        if not st.session_state.get("history_exhausted") and st.button("Load older messages"):
+            messages, cursor = storage.read_history_page(assistant.run_id, st.session_state.get("history_cursor"))
+            st.session_state.setdefault("history_messages", []).extend(messages)
+            st.session_state.history_cursor = cursor
+            st.session_state.history_exhausted = cursor is None
+        for message in reversed(st.session_state.get("history_messages", [])):
+            st.markdown(f"**{message.get('role', '').capitalize()}:** {message.get('content') or ''}")
 
 # Main function to handle Streamlit app layout and interactions
 def main():
@@ -76,22 +519,43 @@ def main():
     uploaded_file = st.sidebar.file_uploader("📄 Upload PDF", type=["pdf"])
     
     if uploaded_file and st.sidebar.button("🛠️ Add to Knowledge Base"):
-        add_document(assistant, BytesIO(uploaded_file.read()))
+        job = get_ingestion_queue().submit(assistant.knowledge_base.vector_db, uploaded_file.name, uploaded_file.getvalue())
+        st.session_state.setdefault("ingest_job_ids", []).append(job.id)
+
+    with st.sidebar:
+        show_ingestion_jobs()
+        show_vector_index_settings(assistant.knowledge_base.vector_db)
 
     question = st.text_input("💬 Ask Your Question:")
     
+    col1, col2 = st.columns([1, 8])
+    with col1:
+        get_answer = st.button("🔍 Get Answer")
+    with col2:
+        stop = st.button("⏹️ Stop")
+    
+    # Clicking Stop reruns the script, which abandons the rendering loop; cancel the worker and keep the partial answer
+    if stop and st.session_state.get("answer_stream"):
+        stream = st.session_state.answer_stream
+        stream.cancel()
+        st.write("📝 **Response:**")
+        st.markdown(stream.text)
+        if stream.cancelled.is_set():
+            st.info("Generation stopped.")
+    
     # When the user submits a question, query the assistant for an answer
-    if st.button("🔍 Get Answer"):
+    if get_answer:
         # Ensure the question is not empty
         if question.strip():
-            with st.spinner("🤔 Thinking..."):
-                # Query the assistant and display the response
-                answer = query_assistant(assistant, question)
-                st.write("📝 **Response:**", answer)
+            # Query the assistant and stream the response as it is generated
+            st.write("📝 **Response:**")
+            query_assistant(assistant, question, st.empty())
         else:
             # Show an error if the question input is empty
             st.error("Please enter a question.")
 
+    show_earlier_conversation(assistant)
+
 # Entry point of the application
 if __name__ == "__main__":
     main()
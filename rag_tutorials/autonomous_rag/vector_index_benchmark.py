@@ -0,0 +1,136 @@
+"""Exact vs ANN search benchmark for the PgVector database used by autorag.py.
+
+For each corpus size, loads synthetic clustered embeddings into a scratch table with COPY, measures exact
+(sequential scan) k-NN latency as ground truth, then builds HNSW and IVFFlat indexes and measures latency
+percentiles and recall@k across a sweep of hnsw.ef_search and ivfflat.probes values. Needs the same
+PgVector container as the app; no OpenAI calls are made. At 1M rows and 1536 dimensions a table takes about
+6 GB and an HNSW build can take an hour, so start with smaller sizes or a lower --dim.
+
+    python vector_index_benchmark.py --sizes 10000 100000 --queries 100 --output index_report.json
+    python vector_index_benchmark.py --sizes 10000 100000 1000000 --dim 1536
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import psycopg
+
+from autorag import DB_URL, HNSW_EF_CONSTRUCTION, HNSW_M, ivfflat_lists
+
+SCHEMA = "ai"
+
+
+def to_vector_literal(vector: np.ndarray) -> str:
+    return "[" + ",".join(f"{value:.6f}" for value in vector) + "]"
+
+
+def clustered_vectors(rng: np.random.Generator, centers: np.ndarray, count: int, spread: float) -> np.ndarray:
+    """Unit vectors scattered around random cluster centers, which is closer to real embeddings than uniform noise."""
+    vectors = centers[rng.integers(len(centers), size=count)] + rng.normal(scale=spread, size=(count, centers.shape[1]))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def load_table(conn: psycopg.Connection, table: str, size: int, centers: np.ndarray, rng: np.random.Generator,
+               spread: float, batch_size: int = 10000) -> float:
+    conn.execute(f"DROP TABLE IF EXISTS {table}")
+    conn.execute(f"CREATE TABLE {table} (id bigint PRIMARY KEY, embedding vector({centers.shape[1]}))")
+    start = time.perf_counter()
+    with conn.cursor().copy(f"COPY {table} (id, embedding) FROM STDIN") as copy:
+        for offset in range(0, size, batch_size):
+            for row, vector in enumerate(clustered_vectors(rng, centers, min(batch_size, size - offset), spread)):
+                copy.write_row((offset + row, to_vector_literal(vector)))
+    conn.execute(f"ANALYZE {table}")
+    return time.perf_counter() - start
+
+
+def run_queries(conn: psycopg.Connection, table: str, queries: np.ndarray, k: int, settings: Dict[str, str]):
+    """Return the result ids and latencies (ms) of a k-NN query per query vector under the given settings."""
+    results, latencies = [], []
+    for query in queries:
+        with conn.transaction():
+            for key, value in settings.items():
+                conn.execute(f"SET LOCAL {key} = {value}")
+            start = time.perf_counter()
+            rows = conn.execute(f"SELECT id FROM {table} ORDER BY embedding <=> %s::vector LIMIT %s",
+                                (to_vector_literal(query), k)).fetchall()
+            latencies.append((time.perf_counter() - start) * 1000)
+        results.append([row[0] for row in rows])
+    return results, latencies
+
+
+def recall(results: List[List[int]], truth: List[List[int]]) -> float:
+    return float(np.mean([len(set(found) & set(expected)) / len(expected) for found, expected in zip(results, truth)]))
+
+
+def percentiles(samples_ms: List[float]) -> Dict[str, float]:
+    return {name: round(float(np.percentile(samples_ms, q)), 2) for name, q in (("p50", 50), ("p95", 95), ("p99", 99))} | \
+        {"mean": round(float(np.mean(samples_ms)), 2)}
+
+
+def build_index(conn: psycopg.Connection, table: str, method: str, size: int, maintenance_work_mem: str) -> Dict:
+    conn.execute(f"DROP INDEX IF EXISTS {table}_ann")
+    params = f"m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION}" if method == "hnsw" else f"lists = {ivfflat_lists(size)}"
+    conn.execute(f"SET maintenance_work_mem = '{maintenance_work_mem}'")
+    start = time.perf_counter()
+    conn.execute(f"CREATE INDEX {table}_ann ON {table} USING {method} (embedding vector_cosine_ops) WITH ({params})")
+    seconds = time.perf_counter() - start
+    size_bytes = conn.execute(f"SELECT pg_relation_size('{table}_ann')").fetchone()[0]
+    return {"params": params, "build_seconds": round(seconds, 2), "size_mb": round(size_bytes / 2**20, 1)}
+
+
+def benchmark_size(conn: psycopg.Connection, size: int, args: argparse.Namespace) -> Dict:
+    rng = np.random.default_rng(args.seed)
+    centers = rng.normal(size=(args.clusters, args.dim))
+    table = f"{SCHEMA}.index_bench_{size}"
+    load_seconds = load_table(conn, table, size, centers, rng, args.spread)
+    queries = clustered_vectors(rng, centers, args.queries, args.spread)
+
+    # Exact search: forbid index scans so the planner falls back to a sequential scan with a sort.
+    truth, exact_ms = run_queries(conn, table, queries, args.k, {"enable_indexscan": "off"})
+    report = {"rows": size, "load_seconds": round(load_seconds, 2), "exact": {"latency_ms": percentiles(exact_ms)}}
+
+    sweeps = {"hnsw": ("hnsw.ef_search", args.ef_search), "ivfflat": ("ivfflat.probes", args.probes)}
+    for method in args.methods:
+        setting, values = sweeps[method]
+        report[method] = build_index(conn, table, method, size, args.maintenance_work_mem) | {"sweep": []}
+        for value in values:
+            results, latencies = run_queries(conn, table, queries, args.k, {setting: str(value)})
+            report[method]["sweep"].append({setting: value, f"recall_at_{args.k}": round(recall(results, truth), 4),
+                                            "latency_ms": percentiles(latencies)})
+        conn.execute(f"DROP INDEX {table}_ann")
+    if not args.keep_tables:
+        conn.execute(f"DROP TABLE {table}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare exact and ANN (HNSW, IVFFlat) search on PgVector.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="Rows per run")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimensions (1536 matches the app)")
+    parser.add_argument("--clusters", type=int, default=100)
+    parser.add_argument("--spread", type=float, default=0.5, help="Noise around each cluster center")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--methods", nargs="+", choices=["hnsw", "ivfflat"], default=["hnsw", "ivfflat"])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[10, 20, 40, 80, 160, 320])
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 5, 10, 20, 50, 100])
+    parser.add_argument("--maintenance-work-mem", default="2GB", help="Memory for index builds")
+    parser.add_argument("--keep-tables", action="store_true", help="Keep the scratch tables after each run")
+    parser.add_argument("--output", default="index_report.json")
+    args = parser.parse_args()
+
+    with psycopg.connect(DB_URL.replace("postgresql+psycopg", "postgresql"), autocommit=True) as conn:
+        conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
+        conn.execute(f"CREATE SCHEMA IF NOT EXISTS {SCHEMA}")
+        report = {"config": {key: value for key, value in vars(args).items() if key != "output"},
+                  "runs": [benchmark_size(conn, size, args) for size in args.sizes]}
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
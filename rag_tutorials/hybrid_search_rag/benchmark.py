@@ -0,0 +1,246 @@
+"""Offline benchmark for the hybrid search RAG pipeline.
+
+Generates a synthetic Markdown corpus with planted facts, ingests it with a deterministic hashing embedder
+and a stub LLM (no API keys or network needed), then measures ingest throughput, hybrid_search and rerank
+latency percentiles, RAG time-to-first-token, recall@k and how often main.py's confidence check would skip
+reranking. The report is written as JSON so it can be compared against a baseline before changing
+chunk_max_size, embedder_sentence_window_size or the reranker.
+Like the app itself, it needs the spaCy `xx_sent_ud_sm` model installed, and importing raglite fetches its
+default FlashRank model once; after that no network access is needed.
+
+    python benchmark.py --docs 50 --queries 100 --output report.json
+    python benchmark.py --chunk-max-size 1000 --baseline report.json
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import litellm
+import mdformat
+import numpy as np
+from litellm import CustomLLM, GenericStreamingChunk, ModelResponse
+from rerankers.models.ranker import BaseRanker
+from rerankers.results import RankedResults, Result
+from rerankers.documents import Document as RerankDocument
+
+import raglite._embed
+import raglite._insert
+from raglite import RAGLiteConfig, insert_document, hybrid_search, vector_search, keyword_search, retrieve_chunks, rerank_chunks, rag
+from raglite._search import reciprocal_rank_fusion
+
+from main import RERANK_SKIP_MARGIN, retrieval_is_confident
+
+STUB_EMBEDDER = "bench-hashing-embedder"
+STUB_LLM = "bench-stub/echo"
+EMBEDDING_DIM = 256
+
+WORDS = ("account balance contract invoice payment policy renewal clause customer supplier delivery "
+         "warranty audit report quarter revenue margin forecast budget approval review schedule meeting "
+         "project milestone release feature backlog incident outage latency storage network cluster").split()
+
+
+def hashing_embedding(model: str, input: List[str], **kwargs) -> Dict:
+    """Deterministic bag-of-words embedding, shaped like a LiteLLM embedding response."""
+    vectors = np.zeros((len(input), EMBEDDING_DIM))
+    for row, text in enumerate(input):
+        for token in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(token.encode()).digest()
+            vectors[row, digest[0] % EMBEDDING_DIM] += 1.0 if digest[1] % 2 else -1.0
+    vectors[:, 0] += 1e-3  # Keep empty strings from producing a zero vector.
+    return {"data": [{"embedding": vector.tolist()} for vector in vectors]}
+
+
+class StubLLM(CustomLLM):
+    """Streams a fixed answer so generation cost doesn't drown out retrieval cost."""
+
+    def completion(self, *args, **kwargs) -> ModelResponse:
+        return litellm.completion(model="gpt-3.5-turbo", messages=kwargs["messages"], mock_response="Benchmark answer.")
+
+    def streaming(self, *args, **kwargs):
+        for index, token in enumerate(["Benchmark ", "answer."]):
+            chunk: GenericStreamingChunk = {"finish_reason": "stop" if index else None, "index": 0, "is_finished": bool(index),
+                                            "text": token, "tool_use": None, "usage": None}
+            yield chunk
+
+
+class StubReranker(BaseRanker):
+    """Scores documents by query term overlap, as a CPU-cheap stand-in for a cross-encoder."""
+
+    def __init__(self, *args, **kwargs):
+        self.verbose = 0
+
+    def score(self, query: str, doc: str) -> float:
+        query_terms = set(re.findall(r"\w+", query.lower()))
+        return float(len(query_terms & set(re.findall(r"\w+", doc.lower()))))
+
+    def rank(self, query: str, docs, doc_ids=None, metadata=None) -> RankedResults:
+        scores = [self.score(query, doc) for doc in docs]
+        order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+        results = [Result(document=RerankDocument(text=docs[i], doc_id=i), score=scores[i], rank=rank + 1)
+                   for rank, i in enumerate(order)]
+        return RankedResults(results=results, query=query, has_scores=True)
+
+
+def install_stubs() -> None:
+    # raglite calls litellm's embedding() directly for non llama-cpp embedders, so we swap it out here.
+    raglite._embed.embedding = hashing_embedding
+    litellm.register_model({STUB_EMBEDDER: {"max_tokens": 8192, "max_input_tokens": 8192, "output_vector_size": EMBEDDING_DIM,
+                                            "input_cost_per_token": 0.0, "output_cost_per_token": 0.0,
+                                            "litellm_provider": "openai", "mode": "embedding"}})
+    litellm.register_model({STUB_LLM: {"max_tokens": 32768, "max_input_tokens": 32768, "max_output_tokens": 1024,
+                                       "input_cost_per_token": 0.0, "output_cost_per_token": 0.0,
+                                       "litellm_provider": "bench-stub", "mode": "chat"}})
+    litellm.custom_provider_map.append({"provider": "bench-stub", "custom_handler": StubLLM()})
+    # Markdown files would otherwise need pandoc; the synthetic corpus is already Markdown.
+    raglite._insert.document_to_markdown = lambda doc_path: mdformat.text(doc_path.read_text())
+
+
+def generate_corpus(corpus_dir: Path, num_docs: int, sections_per_doc: int, seed: int) -> List[Dict[str, str]]:
+    """Write synthetic Markdown documents and return the planted facts to query for."""
+    rng = random.Random(seed)
+    facts = []
+    for doc_index in range(num_docs):
+        sections, planted_section = [], rng.randrange(sections_per_doc)
+        for section_index in range(sections_per_doc):
+            sentences = [" ".join(rng.choices(WORDS, k=rng.randint(8, 16))).capitalize() + "." for _ in range(rng.randint(4, 8))]
+            if section_index == planted_section:
+                codename = f"{rng.choice(WORDS)}{doc_index:04d}"
+                code = f"{rng.randrange(16**8):08x}"
+                sentences.insert(rng.randrange(len(sentences)), f"The access code for project {codename} is {code}.")
+                facts.append({"query": f"What is the access code for project {codename}?", "answer": code})
+            sections.append(f"## Section {section_index + 1}\n\n" + " ".join(sentences))
+        (corpus_dir / f"doc_{doc_index:04d}.md").write_text(f"# Document {doc_index}\n\n" + "\n\n".join(sections))
+    return facts
+
+
+def percentiles(samples_ms: List[float]) -> Dict[str, float]:
+    return {name: round(float(np.percentile(samples_ms, q)), 2) for name, q in (("p50", 50), ("p95", 95), ("p99", 99))} | \
+        {"mean": round(float(np.mean(samples_ms)), 2)}
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict:
+    install_stubs()
+    reranker = {"stub": StubReranker(), "none": None}.get(args.reranker)
+    if args.reranker == "flashrank":
+        from rerankers import Reranker
+        reranker = Reranker("ms-marco-MiniLM-L-12-v2", model_type="flashrank", verbose=0)
+    with tempfile.TemporaryDirectory() as work_dir:
+        work_dir = Path(work_dir)
+        config = RAGLiteConfig(
+            db_url=f"sqlite:///{work_dir / 'bench.sqlite'}",
+            llm=STUB_LLM,
+            embedder=STUB_EMBEDDER,
+            embedder_normalize=True,
+            chunk_max_size=args.chunk_max_size,
+            embedder_sentence_window_size=args.sentence_window,
+            vector_search_query_adapter=False,
+            reranker=reranker,
+        )
+        corpus_dir = work_dir / "corpus"
+        corpus_dir.mkdir()
+        facts = generate_corpus(corpus_dir, args.docs, args.sections, args.seed)
+
+        start = time.perf_counter()
+        for doc_path in sorted(corpus_dir.iterdir()):
+            insert_document(doc_path, config=config)
+        ingest_seconds = time.perf_counter() - start
+        num_chunks = len(retrieve_all_chunk_ids(config))
+
+        # Warm up the vector index (pynndescent compiles with numba on first use) before timing queries.
+        for fact in facts[:args.warmup]:
+            hybrid_search(fact["query"], num_results=10, config=config)
+        queries = random.Random(args.seed).choices(facts, k=args.queries)
+        search_ms, rerank_ms, rag_ms, hits, skips = [], [], [], 0, 0
+        for fact in queries:
+            # Same steps as hybrid_search, split up like main.perform_search so the raw scores are available.
+            start = time.perf_counter()
+            vs_chunk_ids, _ = vector_search(fact["query"], num_results=100, config=config)
+            ks_chunk_ids, ks_scores = keyword_search(fact["query"], num_results=100, config=config)
+            chunk_ids = reciprocal_rank_fusion([vs_chunk_ids, ks_chunk_ids])[0][:10]
+            search_ms.append((time.perf_counter() - start) * 1000)
+            skips += reranker is not None and retrieval_is_confident(chunk_ids, ks_chunk_ids, ks_scores)
+            chunks = retrieve_chunks(chunk_ids, config=config)
+            start = time.perf_counter()
+            chunks = rerank_chunks(fact["query"], chunks, config=config)
+            rerank_ms.append((time.perf_counter() - start) * 1000)
+            hits += any(fact["answer"] in str(chunk) for chunk in chunks[:args.k])
+            start = time.perf_counter()
+            next(iter(rag(fact["query"], search=chunks, max_contexts=5, config=config)))
+            rag_ms.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "config": {"docs": args.docs, "sections": args.sections, "queries": args.queries, "warmup": args.warmup, "k": args.k, "seed": args.seed,
+                   "chunk_max_size": args.chunk_max_size, "embedder_sentence_window_size": args.sentence_window,
+                   "reranker": args.reranker},
+        "ingest": {"documents": args.docs, "chunks": num_chunks, "seconds": round(ingest_seconds, 3),
+                   "chunks_per_second": round(num_chunks / ingest_seconds, 2)},
+        "hybrid_search_ms": percentiles(search_ms),
+        "rerank_ms": percentiles(rerank_ms),
+        "rag_first_token_ms": percentiles(rag_ms),
+        f"recall_at_{args.k}": round(hits / len(queries), 4),
+        "rerank_skip_rate": round(skips / len(queries), 4),
+    }
+
+
+def retrieve_all_chunk_ids(config: RAGLiteConfig) -> List[str]:
+    from raglite._database import Chunk, create_database_engine
+    from sqlmodel import Session, select
+    with Session(create_database_engine(config)) as session:
+        return list(session.exec(select(Chunk.id)).all())
+
+
+def compare_to_baseline(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Return a list of regressions: slower p95 latency beyond the tolerance, lower recall, or a rerank skip path
+    that the baseline took and this run never does."""
+    regressions = []
+    for metric in ("hybrid_search_ms", "rerank_ms", "rag_first_token_ms"):
+        current, previous = report[metric]["p95"], baseline[metric]["p95"]
+        if previous and current > previous * (1 + tolerance):
+            regressions.append(f"{metric} p95 {current} ms > baseline {previous} ms")
+    if report["ingest"]["chunks_per_second"] < baseline["ingest"]["chunks_per_second"] * (1 - tolerance):
+        regressions.append(f"ingest {report['ingest']['chunks_per_second']} chunks/s < baseline {baseline['ingest']['chunks_per_second']}")
+    recall_key = next(key for key in report if key.startswith("recall_at_"))
+    if recall_key in baseline and report[recall_key] < baseline[recall_key] - 0.01:
+        regressions.append(f"{recall_key} {report[recall_key]} < baseline {baseline[recall_key]}")
+    if baseline.get("rerank_skip_rate") and not report["rerank_skip_rate"]:
+        regressions.append(f"reranking was never skipped (baseline {baseline['rerank_skip_rate']}); "
+                           f"check RERANK_SKIP_MARGIN={RERANK_SKIP_MARGIN}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark for the hybrid search RAG pipeline.")
+    parser.add_argument("--docs", type=int, default=20, help="Number of synthetic documents")
+    parser.add_argument("--sections", type=int, default=8, help="Sections per document")
+    parser.add_argument("--queries", type=int, default=50, help="Number of queries to run")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed queries to run before measuring")
+    parser.add_argument("--k", type=int, default=5, help="Cut-off for recall@k")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk-max-size", type=int, default=2000)
+    parser.add_argument("--sentence-window", type=int, default=2)
+    parser.add_argument("--reranker", choices=["stub", "none", "flashrank"], default="stub",
+                        help="'flashrank' downloads the MiniLM model on first use")
+    parser.add_argument("--output", default="benchmark_report.json")
+    parser.add_argument("--baseline", help="Previous report to compare against; exits non-zero on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown before failing")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(json.dumps(report, indent=2))
+    if args.baseline:
+        regressions = compare_to_baseline(report, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,28 @@
 import os
+import re
+import json
+import hashlib
 import logging
+import sqlite3
+import tempfile
+import threading
 import streamlit as st
-from raglite import RAGLiteConfig, insert_document, hybrid_search, retrieve_chunks, rerank_chunks, rag
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from litellm import completion
+from logging.handlers import RotatingFileHandler
+from raglite import RAGLiteConfig, insert_document, vector_search, keyword_search, retrieve_chunks, rerank_chunks, rag
+from raglite._database import Chunk, Document, create_database_engine, hash_bytes
+from raglite._embed import embed_sentences
+from raglite._litellm import LlamaCppPythonLLM
+from raglite._search import reciprocal_rank_fusion
 from rerankers import Reranker
-from typing import List, Dict, Any
+from rerankers.models.ranker import BaseRanker
+from sqlalchemy.exc import IntegrityError
+from llama_cpp import LLAMA_POOLING_TYPE_NONE
+from sqlmodel import Session, func, select
+from typing import List, Dict, Any, Optional, Tuple
 from pathlib import Path
 import time
 import warnings
@@ -12,6 +31,24 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 warnings.filterwarnings("ignore", message=".*torch.classes.*")
 
+LATENCY_LOG_PATH = os.getenv("LATENCY_LOG_PATH", "latency.jsonl")
+HISTORY_TOKEN_BUDGET = 1000  # Tokens of chat history sent with each question.
+HISTORY_SUMMARY_MAX_TOKENS = 300
+RETRIEVAL_CACHE_SIZE = 256
+RETRIEVAL_CACHE_TTL = 3600  # seconds
+RERANK_TOP_N = 8  # Hybrid hits sent to the reranker; the rest keep their hybrid order.
+RERANK_SKIP_MARGIN = 0.25  # Skip reranking when the top hit leads the keyword runner-up by this fraction of its score.
+MODEL_RAM_BUDGET_GB = float(os.getenv("MODEL_RAM_BUDGET_GB", "8"))
+MODEL_IDLE_TIMEOUT = 1800  # seconds
+# llama.cpp splits each embedding batch over its own thread pool. A larger batch also lets RAGLite's late
+# chunking embed longer segments per call, so a document needs fewer embedder calls.
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "2048"))
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", str(os.cpu_count() or 1)))
+# A llama-cpp-python model can't be shared across threads, so local ingestion runs one document at a time
+# on a worker thread. Raise this only if your embedder is served from a separate process.
+INGEST_MAX_WORKERS = 1
+INGEST_CONFLICT_RETRIES = 2  # Reruns of a document insert that lost a race on a shared chunk id.
+
 RAG_SYSTEM_PROMPT = """
 You are a friendly and knowledgeable assistant that provides complete and insightful answers.
 Answer the user's question using only the context below.
@@ -19,6 +56,62 @@ When responding, you MUST NOT reference the existence of the context, directly o
 Instead, you MUST treat the context as if its contents are entirely part of your working memory.
 """.strip()
 
+# RAG_SYSTEM_PROMPT is sent as the first chat message so it stays a stable prefix across turns; RAGLite appends
+# the retrieved contexts to this shorter header instead.
+RAG_CONTEXT_PROMPT = "Context for the user's latest question:"
+
+class ChatHistory:
+    """Chat turns for rag(): a cached rolling summary of older turns plus a window of recent turns within a token budget.
+
+    The RAG instructions lead the message list so they form a stable prompt prefix for provider-side caching, and
+    older turns are folded into the summary in one go, so that prefix only changes when the budget is exceeded.
+    """
+
+    def __init__(self, token_budget: int, keep_turns: int = 2):
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.turns: List[Tuple[str, str]] = []
+        self.window_start = 0
+        self.window_tokens = 0
+        self.summary = ""
+
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        return len(text) // 3  # Same estimate RAGLite uses when sizing the context window.
+
+    def __iter__(self):
+        return iter(self.turns)
+
+    def append(self, turn: Tuple[str, str], config: RAGLiteConfig) -> None:
+        self.turns.append(turn)
+        self.window_tokens += sum(self.count_tokens(msg) for msg in turn)
+        if self.window_tokens + self.count_tokens(self.summary) > self.token_budget:
+            self._compact(config)
+
+    def messages(self) -> List[Dict[str, str]]:
+        messages = [{"role": "system", "content": RAG_SYSTEM_PROMPT}]
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{self.summary}"})
+        for user_msg, assistant_msg in self.turns[self.window_start:]:
+            messages += [{"role": "user", "content": user_msg}, {"role": "assistant", "content": assistant_msg}]
+        return [message for message in messages if message["content"]]
+
+    def _compact(self, config: RAGLiteConfig) -> None:
+        fold_end = len(self.turns) - self.keep_turns
+        if fold_end <= self.window_start:
+            return
+        transcript = "\n".join(f"User: {user_msg}\nAssistant: {assistant_msg}" for user_msg, assistant_msg in self.turns[self.window_start:fold_end])
+        try:
+            response = completion(model=config.llm, max_tokens=HISTORY_SUMMARY_MAX_TOKENS, messages=[
+                {"role": "system", "content": "Summarize this conversation in a few sentences, keeping facts, names and open questions."},
+                {"role": "user", "content": f"{self.summary}\n{transcript}".strip()},
+            ])
+            self.summary = response.choices[0].message.content.strip()
+        except Exception as e:
+            logger.error(f"History summary error: {str(e)}")
+        self.window_start = fold_end
+        self.window_tokens = sum(self.count_tokens(msg) for turn in self.turns[fold_end:] for msg in turn)
+
 def initialize_config(settings: Dict[str, Any]) -> RAGLiteConfig:
     try:
         return RAGLiteConfig(
@@ -32,23 +125,376 @@ def initialize_config(settings: Dict[str, Any]) -> RAGLiteConfig:
     except Exception as e:
         raise ValueError(f"Configuration error: {e}")
 
-def process_document(file_path: str) -> bool:
+class ModelRegistry:
+    """Process-wide cache of llama-cpp-python models shared by every Streamlit session.
+
+    RAGLite loads GGUF models through `LlamaCppPythonLLM.llm`, which caches them forever. The registry
+    takes over that hook so each model is loaded once (memory-mapped), whichever name RAGLite asks for it
+    by, and the least recently used models are closed when they sit idle for too long or the total size
+    exceeds the RAM budget. Sessions lease the models of their config for the length of a turn or an
+    ingestion; leased models are never evicted, so another session can't close a model mid-stream and a
+    turn doesn't swap its own LLM and embedder in and out when both together exceed the budget.
+    """
+
+    def __init__(self, ram_budget_bytes: int, idle_timeout: float):
+        self.ram_budget_bytes = ram_budget_bytes
+        self.idle_timeout = idle_timeout
+        self._models: "OrderedDict[Tuple, Tuple[Any, int, float]]" = OrderedDict()
+        self._leases: Counter = Counter()  # model name -> number of active leases
+        self._load_locks: Dict[Tuple, threading.Lock] = {}
+        self._lock = threading.RLock()
+        if not hasattr(LlamaCppPythonLLM, "uncached_llm"):
+            LlamaCppPythonLLM.uncached_llm = staticmethod(LlamaCppPythonLLM.llm.__wrapped__)
+        self._load_model = LlamaCppPythonLLM.uncached_llm
+        LlamaCppPythonLLM.llm = staticmethod(self.get)
+
+    def get(self, model: str, **kwargs: Any):
+        # RAGLite asks for the same model under different names and kwargs: the LLM with and without LiteLLM's
+        # provider prefix, the embedder with and without pooling_type (token embeddings, which RAGLite pools
+        # itself). Normalize both so each GGUF is loaded once.
+        name = self.model_name(model)
+        if kwargs.get("embedding"):
+            kwargs = {"n_batch": EMBED_BATCH_SIZE, "n_ubatch": EMBED_BATCH_SIZE, "n_threads": EMBED_THREADS,
+                      "n_threads_batch": EMBED_THREADS, "pooling_type": LLAMA_POOLING_TYPE_NONE, **kwargs}
+        key = (name, tuple(sorted(kwargs.items())))
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        # Loading takes seconds, so it holds only this model's lock and other sessions keep using theirs.
+        with load_lock:
+            with self._lock:
+                if key in self._models:
+                    llm, size, _ = self._models.pop(key)
+                    self._models[key] = (llm, size, time.monotonic())
+                    self._evict(keep=key)
+                    return llm
+            logger.info(f"Loading {name} into the model registry")
+            # Load under the prefixed name, which is the one RAGLite looks up in LiteLLM's model info.
+            llm = self._load_model(f"llama-cpp-python/{name}", use_mmap=True, **kwargs)
+            size = os.path.getsize(llm.model_path)
+            with self._lock:
+                self._models[key] = (llm, size, time.monotonic())
+                self._evict(keep=key)
+            return llm
+
+    @staticmethod
+    def model_name(model: str) -> str:
+        # RAGLite passes the model with and without LiteLLM's provider prefix depending on the call site.
+        return model.replace("llama-cpp-python/", "")
+
+    @contextmanager
+    def lease(self, config: RAGLiteConfig):
+        names = [self.model_name(config.llm), self.model_name(config.embedder)]
+        with self._lock:
+            self._leases.update(names)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._leases.subtract(names)
+
+    def warm_up(self, config: RAGLiteConfig) -> None:
+        # Run a throwaway prompt and embedding so the first real request doesn't pay for page faults.
+        with self.lease(config):
+            self.get(config.llm).create_completion("Hello", max_tokens=1)
+            self.get(config.embedder, embedding=True, pooling_type=LLAMA_POOLING_TYPE_NONE).embed("Hello")
+
+    def loaded_models(self) -> List[str]:
+        with self._lock:
+            return [key[0] for key in self._models]
+
+    def _evict(self, keep: Tuple) -> None:
+        now = time.monotonic()
+        for key, (llm, size, last_used) in list(self._models.items()):
+            total_size = sum(entry[1] for entry in self._models.values())
+            if key == keep or self._leases[key[0]] > 0 or \
+                    (total_size <= self.ram_budget_bytes and now - last_used <= self.idle_timeout):
+                continue
+            logger.info(f"Evicting {key[0]} from the model registry")
+            del self._models[key]
+            if hasattr(llm, "close"):
+                llm.close()
+
+@st.cache_resource
+def get_model_registry() -> ModelRegistry:
+    return ModelRegistry(ram_budget_bytes=int(MODEL_RAM_BUDGET_GB * 1024**3), idle_timeout=MODEL_IDLE_TIMEOUT)
+
+latency_logger = logging.getLogger("raglite_latency")
+latency_logger.propagate = False
+if not latency_logger.handlers:
+    _latency_handler = RotatingFileHandler(LATENCY_LOG_PATH, maxBytes=5_000_000, backupCount=3)
+    _latency_handler.setFormatter(logging.Formatter("%(message)s"))
+    latency_logger.addHandler(_latency_handler)
+    latency_logger.setLevel(logging.INFO)
+
+class TurnTrace:
+    """Per-stage timings (in ms) for one chat turn, written as a JSON line to the latency log."""
+
+    def __init__(self, query: str):
+        self.query = query
+        self.spans: Dict[str, float] = {}
+        self.path = "rag"
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def span(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, start)
+
+    def record(self, stage: str, start: float) -> None:
+        self.spans[stage] = round((time.perf_counter() - start) * 1000, 1)
+
+    def finish(self) -> None:
+        self.record("total", self._start)
+        latency_logger.info(json.dumps({"ts": time.time(), "path": self.path, "query_chars": len(self.query), "spans_ms": self.spans}))
+
+class RetrievalCache:
+    """LRU + TTL cache of reranked chunk ids, optionally persisted to SQLite so it survives restarts."""
+
+    def __init__(self, max_size: int = 256, ttl: float = 3600, db_path: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, List[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS retrieval_cache (key TEXT PRIMARY KEY, created REAL, chunk_ids TEXT)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(query: str, config: RAGLiteConfig) -> str:
+        normalized = re.sub(r"\s+", " ", query).strip().lower().rstrip("?!. ")
+        return hashlib.sha256(f"{config_fingerprint(config)}|{normalized}".encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute("SELECT created, chunk_ids FROM retrieval_cache WHERE key = ?", (key,)).fetchone()
+                entry = (row[0], json.loads(row[1])) if row else None
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.ttl:
+                self._delete(key)
+                return None
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._evict()
+            return entry[1]
+
+    def set(self, key: str, chunk_ids: List[str]) -> None:
+        with self._lock:
+            entry = (time.time(), chunk_ids)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._evict()
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO retrieval_cache VALUES (?, ?, ?)", (key, entry[0], json.dumps(chunk_ids)))
+                self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM retrieval_cache")
+                self._db.commit()
+
+    def _delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM retrieval_cache WHERE key = ?", (key,))
+            self._db.commit()
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+def config_fingerprint(config: RAGLiteConfig) -> str:
+    reranker = config.reranker
+    reranker_name = f"{type(reranker).__name__}:{getattr(reranker, 'model_name', '')}" if reranker else "none"
+    return "|".join([str(config.db_url), config.embedder, str(config.chunk_max_size),
+                     str(config.embedder_sentence_window_size), reranker_name])
+
+@st.cache_resource
+def get_retrieval_cache() -> RetrievalCache:
+    return RetrievalCache(max_size=RETRIEVAL_CACHE_SIZE, ttl=RETRIEVAL_CACHE_TTL, db_path=os.getenv("RETRIEVAL_CACHE_DB"))
+
+class RerankScoreCache:
+    """LRU cache of reranker scores keyed on (query hash, chunk id). Chunk ids are content hashes, so
+    scores stay valid when new documents are ingested."""
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._scores: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, query_key: str, chunk_ids: List[str]) -> Dict[str, float]:
+        with self._lock:
+            found = {}
+            for chunk_id in chunk_ids:
+                if (query_key, chunk_id) in self._scores:
+                    self._scores.move_to_end((query_key, chunk_id))
+                    found[chunk_id] = self._scores[(query_key, chunk_id)]
+            return found
+
+    def set_many(self, query_key: str, scores: Dict[str, float]) -> None:
+        with self._lock:
+            for chunk_id, score in scores.items():
+                self._scores[(query_key, chunk_id)] = score
+                self._scores.move_to_end((query_key, chunk_id))
+            while len(self._scores) > self.max_size:
+                self._scores.popitem(last=False)
+
+@st.cache_resource
+def get_rerank_cache() -> RerankScoreCache:
+    return RerankScoreCache()
+
+def retrieval_is_confident(chunk_ids: List[str], ks_chunk_ids: List[str], ks_scores: List[float]) -> bool:
+    """True when the top fused hit is also keyword search's top hit and clearly leads its keyword runner-up.
+
+    This looks at the raw keyword scores because the fused scores can't show a clear winner: with RRF's k=60, the
+    top hit's lead over the runner-up is at most about a third of its score, whatever the searches returned. The
+    lead is relative, so it works for both BM25 (SQLite) and ts_rank (Postgres) scores.
+    """
+    if not chunk_ids or len(ks_chunk_ids) < 2 or chunk_ids[0] != ks_chunk_ids[0] or ks_scores[0] <= 0:
+        return False
+    return (ks_scores[0] - ks_scores[1]) / ks_scores[0] >= RERANK_SKIP_MARGIN
+
+def rerank_with_cache(query: str, chunks: List[Chunk], confident: bool, config: RAGLiteConfig) -> List[Chunk]:
+    reranker = config.reranker
+    if not isinstance(reranker, BaseRanker) or len(chunks) < 2:
+        return rerank_chunks(query, chunks, config=config)
+    if confident:
+        return chunks
+    candidates, tail = chunks[:RERANK_TOP_N], chunks[RERANK_TOP_N:]
+    cache = get_rerank_cache()
+    query_key = RetrievalCache.make_key(query, config)
+    scores = cache.get_many(query_key, [chunk.id for chunk in candidates])
+    uncached = [chunk for chunk in candidates if chunk.id not in scores]
+    if uncached:
+        results = reranker.rank(query=query, docs=[str(chunk) for chunk in uncached])
+        new_scores = {uncached[result.doc_id].id: result.score for result in results.results}
+        cache.set_many(query_key, new_scores)
+        scores.update(new_scores)
+    return sorted(candidates, key=lambda chunk: scores[chunk.id], reverse=True) + tail
+
+def document_complete(doc_id: str, config: RAGLiteConfig) -> bool:
+    # RAGLite commits the Document row before its chunks, so the row alone may belong to an interrupted insert.
+    with Session(create_database_engine(config)) as session:
+        document = session.get(Document, doc_id)
+        return document is not None and bool(document.metadata_.get("ingest_complete"))
+
+def mark_document_complete(doc_id: str, config: RAGLiteConfig) -> None:
+    with Session(create_database_engine(config)) as session:
+        document = session.get(Document, doc_id)
+        document.metadata_ = {**document.metadata_, "ingest_complete": True}
+        session.add(document)
+        session.commit()
+
+def insert_document_file(temp_path: Path, config: RAGLiteConfig) -> None:
+    # Chunk ids are hashes of the chunk body, so two workers can race to insert the same chunk. RAGLite skips
+    # chunks and documents that already exist, so rerunning the insert after a conflict picks up where it failed.
+    for attempt in range(INGEST_CONFLICT_RETRIES + 1):
+        try:
+            insert_document(temp_path, config=config)
+            return
+        except IntegrityError as e:
+            if attempt == INGEST_CONFLICT_RETRIES:
+                raise
+            logger.warning(f"Retrying {temp_path.name} after a conflicting insert: {e.orig!r}")
+
+def count_chunks(doc_id: str, config: RAGLiteConfig) -> int:
+    with Session(create_database_engine(config)) as session:
+        return session.exec(select(func.count()).select_from(Chunk).where(Chunk.document_id == doc_id)).one()
+
+def process_document(file_name: str, file_bytes: bytes, config: RAGLiteConfig) -> Tuple[str, float]:
+    # Runs on a worker thread, so it must not touch st.session_state.
+    # Returns the status and the ingest throughput in chunks per second.
     try:
-        if not st.session_state.get('my_config'):
-            raise ValueError("Configuration not initialized")
-        insert_document(Path(file_path), config=st.session_state.my_config)
-        return True
+        doc_id = hash_bytes(file_bytes)
+        if document_complete(doc_id, config):
+            return "skipped", 0.0
+        start = time.perf_counter()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            temp_path = Path(temp_dir) / file_name
+            temp_path.write_bytes(file_bytes)
+            insert_document_file(temp_path, config=config)
+        mark_document_complete(doc_id, config)
+        chunks_per_second = count_chunks(doc_id, config) / (time.perf_counter() - start)
+        logger.info(f"Ingested {file_name} at {chunks_per_second:.1f} chunks/s")
+        return "processed", chunks_per_second
     except Exception as e:
-        logger.error(f"Error processing document: {str(e)}")
-        return False
+        logger.error(f"Error processing document {file_name}: {str(e)}")
+        return "failed", 0.0
 
-def perform_search(query: str) -> List[dict]:
+def ingest_documents(uploaded_files) -> bool:
+    config = st.session_state.my_config
+    pending = {}
+    for uploaded_file in uploaded_files:
+        file_bytes = uploaded_file.getvalue()
+        doc_id = hash_bytes(file_bytes)
+        if doc_id not in st.session_state.ingested_docs:
+            pending[doc_id] = (uploaded_file.name, file_bytes)
+    if not pending:
+        return bool(st.session_state.ingested_docs)
+
+    # SQLite only allows a single writer and RAGLite rebuilds its vector index on every insert.
+    max_workers = 1 if str(config.db_url).startswith("sqlite") else INGEST_MAX_WORKERS
+    statuses = []
+    progress = st.progress(0.0, text=f"Processing {len(pending)} document(s)...")
+    with get_model_registry().lease(config), ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(process_document, name, file_bytes, config): (doc_id, name)
+                   for doc_id, (name, file_bytes) in pending.items()}
+        for done, future in enumerate(as_completed(futures), start=1):
+            doc_id, name = futures[future]
+            status, chunks_per_second = future.result()
+            statuses.append(status)
+            if status == "failed":
+                st.error(f"Failed to process: {name}")
+            else:
+                st.session_state.ingested_docs.add(doc_id)
+                st.success(f"Already in database: {name}" if status == "skipped" else f"Successfully processed: {name} ({chunks_per_second:.1f} chunks/s)")
+            progress.progress(done / len(futures), text=f"Processed {done}/{len(futures)}: {name}")
+    progress.empty()
+    # New chunks can change the results of any query, so drop every cached retrieval.
+    if any(status == "processed" for status in statuses):
+        get_retrieval_cache().clear()
+    return bool(st.session_state.ingested_docs)
+
+def perform_search(query: str, trace: Optional[TurnTrace] = None) -> List[dict]:
+    trace = trace or TurnTrace(query)
     try:
-        chunk_ids, scores = hybrid_search(query, num_results=10, config=st.session_state.my_config)
+        config = st.session_state.my_config
+        cache = get_retrieval_cache()
+        cache_key = cache.make_key(query, config)
+        with trace.span("cache_lookup"):
+            cached_ids = cache.get(cache_key)
+        if cached_ids is not None:
+            trace.path = "rag_cached"
+            with trace.span("retrieve_chunks"):
+                return retrieve_chunks(cached_ids, config=config) if cached_ids else []
+        # Same steps as raglite's hybrid_search, split up so each stage can be timed.
+        with trace.span("hybrid_search"):
+            with trace.span("embed_query"):
+                query_embedding = embed_sentences([query], config=config)
+            with trace.span("vector_search"):
+                vs_chunk_ids, _ = vector_search(query_embedding, num_results=100, config=config)
+            with trace.span("keyword_search"):
+                ks_chunk_ids, ks_scores = keyword_search(query, num_results=100, config=config)
+            chunk_ids, _ = reciprocal_rank_fusion([vs_chunk_ids, ks_chunk_ids])
+            chunk_ids = chunk_ids[:10]
         if not chunk_ids:
+            cache.set(cache_key, [])
             return []
-        chunks = retrieve_chunks(chunk_ids, config=st.session_state.my_config)
-        return rerank_chunks(query, chunks, config=st.session_state.my_config)
+        with trace.span("retrieve_chunks"):
+            chunks = retrieve_chunks(chunk_ids, config=config)
+        with trace.span("rerank_chunks"):
+            reranked = rerank_with_cache(query, chunks, retrieval_is_confident(chunk_ids, ks_chunk_ids, ks_scores), config)
+        cache.set(cache_key, [chunk.id for chunk in reranked])
+        return reranked
     except Exception as e:
         logger.error(f"Search error: {str(e)}")
         return []
@@ -86,7 +532,9 @@ def main():
     
     for state_var in ['chat_history', 'documents_loaded', 'my_config']:
         if state_var not in st.session_state:
-            st.session_state[state_var] = [] if state_var == 'chat_history' else False if state_var == 'documents_loaded' else None
+            st.session_state[state_var] = ChatHistory(HISTORY_TOKEN_BUDGET) if state_var == 'chat_history' else False if state_var == 'documents_loaded' else None
+    if 'ingested_docs' not in st.session_state:
+        st.session_state.ingested_docs = set()
 
     with st.sidebar:
         st.title("Configuration")
@@ -112,6 +560,11 @@ def main():
             help="Database connection URL"
         )
         
+        st.checkbox("Show latency panel", key="show_latency")
+        loaded_models = get_model_registry().loaded_models()
+        if loaded_models:
+            st.caption("Loaded models: " + ", ".join(model.split("/")[-1] for model in loaded_models))
+
         if st.button("Save Configuration"):
             try:
                 if not all([llm_path, embedder_path, db_url]):
@@ -125,6 +578,8 @@ def main():
                 }
                 
                 st.session_state.my_config = initialize_config(settings)
+                with st.spinner("Loading models..."):
+                    get_model_registry().warm_up(st.session_state.my_config)
                 st.success("Configuration saved successfully!")
                 
             except Exception as e:
@@ -140,22 +595,8 @@ def main():
             key="pdf_uploader"
         )
 
-        if uploaded_files:
-            success = False
-            for uploaded_file in uploaded_files:
-                with st.spinner(f"Processing {uploaded_file.name}..."):
-                    temp_path = f"temp_{uploaded_file.name}"
-                    with open(temp_path, "wb") as f:
-                        f.write(uploaded_file.getvalue())
-                    
-                    if process_document(temp_path):
-                        st.success(f"Successfully processed: {uploaded_file.name}")
-                        success = True
-                    else:
-                        st.error(f"Failed to process: {uploaded_file.name}")
-                    os.remove(temp_path)
-            
-            if success:
+        if uploaded_files and ingest_documents(uploaded_files):
+            if not st.session_state.documents_loaded:
                 st.session_state.documents_loaded = True
                 st.success("Documents are ready! You can now ask questions about them.")
 
@@ -167,41 +608,47 @@ def main():
         user_input = st.chat_input("Ask a question about the documents...")
         if user_input:
             with st.chat_message("user"): st.write(user_input)
-            with st.chat_message("assistant"):
+            with st.chat_message("assistant"), get_model_registry().lease(st.session_state.my_config):
                 message_placeholder = st.empty()
                 try:
-                    reranked_chunks = perform_search(query=user_input)
+                    trace = TurnTrace(user_input)
+                    reranked_chunks = perform_search(query=user_input, trace=trace)
                     if not reranked_chunks or len(reranked_chunks) == 0:
                         logger.info("No relevant documents found. Falling back to local LLM.")
                         with st.spinner("Using general knowledge to answer..."):
-                            full_response = handle_fallback(user_input)
+                            trace.path = "fallback"
+                            with trace.span("fallback"):
+                                full_response = handle_fallback(user_input)
                             if full_response.startswith("I apologize"):
                                 st.warning("No relevant documents found and fallback failed.")
                             else:
                                 st.info("Answering from general knowledge.")
                     else:
-                        formatted_messages = [
-                            {"role": "user" if i % 2 == 0 else "assistant", "content": msg}
-                            for i, msg in enumerate([m for pair in st.session_state.chat_history for m in pair])
-                            if msg
-                        ]
+                        formatted_messages = st.session_state.chat_history.messages()
                         
+                        # Reuse the reranked chunks so retrieval runs once per turn.
                         response_stream = rag(
                             prompt=user_input,
-                            system_prompt=RAG_SYSTEM_PROMPT,
-                            search=hybrid_search,
+                            system_prompt=RAG_CONTEXT_PROMPT,
+                            search=reranked_chunks,
                             messages=formatted_messages,
                             max_contexts=5,
                             config=st.session_state.my_config
                         )
                         
                         full_response = ""
+                        stream_start = time.perf_counter()
                         for chunk in response_stream:
+                            if chunk and "rag_first_token" not in trace.spans:
+                                trace.record("rag_first_token", stream_start)
                             full_response += chunk
                             message_placeholder.markdown(full_response + "▌")
+                        trace.record("rag_stream", stream_start)
                     
                     message_placeholder.markdown(full_response)
-                    st.session_state.chat_history.append((user_input, full_response))
+                    st.session_state.chat_history.append((user_input, full_response), st.session_state.my_config)
+                    trace.finish()
+                    st.session_state.last_trace = trace
                     
                 except Exception as e:
                     logger.error(f"Error: {str(e)}")
@@ -213,5 +660,11 @@ def main():
             else "Please upload some documents to get started."
         )
 
+    if st.session_state.get('show_latency') and st.session_state.get('last_trace'):
+        with st.sidebar:
+            trace = st.session_state.last_trace
+            st.subheader(f"Last turn latency ({trace.path})")
+            st.table({"stage": list(trace.spans), "ms": list(trace.spans.values())})
+
 if __name__ == "__main__":
     main()
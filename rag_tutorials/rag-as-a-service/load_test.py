@@ -0,0 +1,177 @@
+"""Load generator for RAGPipeline.process_query.
+
+Starts the mock Ragie service from mock_ragie.py in-process (or uses --base-url), ingests a synthetic corpus
+through the pipeline, then issues queries open-loop at a target QPS: each query is scheduled at a fixed time
+whether or not earlier ones have finished, so a saturated client shows up as queueing delay instead of a
+silently lower request rate. Claude is replaced by a stub that streams a fixed answer after a configurable
+delay unless --llm anthropic is given. Reports throughput, latency and time-to-first-token percentiles,
+errors, and how often the HTTP connection pool overflowed.
+
+    python load_test.py --qps 20 --duration 30 --concurrency 32
+    python load_test.py --qps 50 --latency-ms 80 --jitter-ms 40 --error-rate 0.05 --output load_report.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+from mock_ragie import start_mock_server
+from rag_app import RAGPipeline, create_http_session
+
+WORDS = ("account balance contract invoice payment policy renewal clause customer supplier delivery "
+         "warranty audit report quarter revenue margin forecast budget approval review schedule meeting "
+         "project milestone release feature backlog incident outage latency storage network cluster").split()
+
+
+class StubLLMPipeline(RAGPipeline):
+    """Streams a fixed answer so the load test measures the retrieval path, not Claude."""
+    first_token_ms = 300.0
+    token_ms = 10.0
+    num_tokens = 50
+
+    def generate_response(self, system_prompt: List[Dict], user_message: str) -> Iterator[str]:
+        time.sleep(self.first_token_ms / 1000)
+        for _ in range(self.num_tokens):
+            yield "token "
+            time.sleep(self.token_ms / 1000)
+
+
+class PoolOverflowCounter(logging.Handler):
+    """Counts urllib3's "Connection pool is full, discarding connection" warnings."""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord):
+        if "pool is full" in record.getMessage():
+            self.count += 1
+
+
+def generate_corpus(corpus_dir: Path, num_docs: int, seed: int) -> List[Dict[str, str]]:
+    """Write synthetic text documents with one planted fact each and return their file:// URLs and queries."""
+    rng = random.Random(seed)
+    documents = []
+    for doc_index in range(num_docs):
+        paragraphs = [" ".join(rng.choices(WORDS, k=rng.randint(20, 40))).capitalize() + "." for _ in range(rng.randint(4, 10))]
+        codename, code = f"{rng.choice(WORDS)}{doc_index:04d}", f"{rng.randrange(16**8):08x}"
+        paragraphs.insert(rng.randrange(len(paragraphs)), f"The access code for project {codename} is {code}.")
+        path = corpus_dir / f"doc_{doc_index:04d}.txt"
+        path.write_text("\n\n".join(paragraphs))
+        documents.append({"url": path.as_uri(), "query": f"What is the access code for project {codename}?", "answer": code})
+    return documents
+
+
+def percentiles(samples_ms: List[float]) -> Dict[str, float]:
+    if not samples_ms:
+        return {}
+    ordered = sorted(samples_ms)
+    rank = lambda q: ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+    return {"p50": round(rank(50), 2), "p95": round(rank(95), 2), "p99": round(rank(99), 2),
+            "mean": round(sum(ordered) / len(ordered), 2), "max": round(ordered[-1], 2)}
+
+
+def run_query(pipeline: RAGPipeline, query: str, scheduled: float) -> Dict:
+    started = time.perf_counter()
+    result = {"queue_delay_ms": (started - scheduled) * 1000}
+    try:
+        stream = pipeline.process_query(query)
+        next(stream)
+        result["first_token_ms"] = (time.perf_counter() - scheduled) * 1000
+        for _ in stream:
+            pass
+        result["latency_ms"] = (time.perf_counter() - scheduled) * 1000
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {str(e)[:80]}"
+    return result
+
+
+def run_load_test(args: argparse.Namespace) -> Dict:
+    server = None
+    base_url = args.base_url
+    if not base_url:
+        server, base_url = start_mock_server(index_seconds=0.2, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                             error_rate=args.error_rate, error_status=args.error_status)
+    overflow_counter = PoolOverflowCounter()
+    logging.getLogger("urllib3.connectionpool").addHandler(overflow_counter)
+
+    pipeline_class = RAGPipeline if args.llm == "anthropic" else StubLLMPipeline
+    StubLLMPipeline.first_token_ms = args.llm_first_token_ms
+    pipeline = pipeline_class(os.getenv("RAGIE_API_KEY", "mock-key"), os.getenv("ANTHROPIC_API_KEY", "unused"),
+                              session=create_http_session(), base_url=base_url)
+
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        documents = generate_corpus(Path(corpus_dir), args.docs, args.seed)
+        start = time.perf_counter()
+        failed = [url for url, _, error in pipeline.ingest_documents([doc["url"] for doc in documents]) if error]
+        ingest_seconds = time.perf_counter() - start
+
+        # Check retrieval quality once, outside the timed run.
+        hits = sum(any(doc["answer"] in chunk for chunk in pipeline.retrieve_chunks(doc["query"])) for doc in documents)
+
+        rng = random.Random(args.seed)
+        num_requests = int(args.qps * args.duration)
+        futures = []
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            start = time.perf_counter()
+            for i in range(num_requests):
+                scheduled = start + i / args.qps
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(executor.submit(run_query, pipeline, rng.choice(documents)["query"], scheduled))
+            results = [future.result() for future in futures]
+            wall_seconds = time.perf_counter() - start
+
+    if server:
+        server.shutdown()
+    logging.getLogger("urllib3.connectionpool").removeHandler(overflow_counter)
+    completed = [result for result in results if "error" not in result]
+    return {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "ingest": {"documents": args.docs, "failed": len(failed), "seconds": round(ingest_seconds, 3)},
+        "retrieval_hit_rate": round(hits / len(documents), 4),
+        "requests": num_requests,
+        "completed": len(completed),
+        "errors": dict(Counter(result["error"] for result in results if "error" in result)),
+        "target_qps": args.qps,
+        "throughput_qps": round(len(completed) / wall_seconds, 2),
+        "latency_ms": percentiles([result["latency_ms"] for result in completed]),
+        "first_token_ms": percentiles([result["first_token_ms"] for result in completed]),
+        "queue_delay_ms": percentiles([result["queue_delay_ms"] for result in results]),
+        "pool_overflows": overflow_counter.count,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive RAGPipeline.process_query at a target QPS.")
+    parser.add_argument("--qps", type=float, default=10.0, help="Target queries per second")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds to generate load for")
+    parser.add_argument("--concurrency", type=int, default=32, help="Maximum in-flight queries")
+    parser.add_argument("--docs", type=int, default=20, help="Number of synthetic documents to ingest")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--base-url", help="Use an already running Ragie-compatible server instead of an in-process mock")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Mock latency added to every request")
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of mock requests that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--llm", choices=["stub", "anthropic"], default="stub",
+                        help="'anthropic' calls Claude for real and needs ANTHROPIC_API_KEY")
+    parser.add_argument("--llm-first-token-ms", type=float, default=300.0, help="Stub LLM time to first token")
+    parser.add_argument("--output", default="load_report.json")
+    args = parser.parse_args()
+
+    report = run_load_test(args)
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""Local stand-in for the parts of the Ragie API that rag_app.py uses.
+
+Uploaded documents move through Ragie's processing statuses (pending -> ... -> indexed -> ready) over a
+configurable time, so the upload, status polling and retrieval flow can be exercised offline. Document
+URLs are fetched with urllib, so `file://` and `data:` URLs work without network access. Retrieval fuses
+BM25 keyword scores with hashed character-trigram vectors, and every request can be given extra latency
+and a rate of injected 429/5xx errors to exercise the client's pooling and retries.
+
+    python mock_ragie.py --port 8900 --index-seconds 3
+    python mock_ragie.py --latency-ms 80 --jitter-ms 40 --error-rate 0.05 --error-status 503
+    RAGIE_BASE_URL=http://127.0.0.1:8900 streamlit run rag_app.py
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.request import urlopen
+
+# (status, fraction of the document's indexing time at which it is reached)
+STATUS_SCHEDULE = [
+    ("pending", 0.0),
+    ("partitioning", 0.1),
+    ("partitioned", 0.3),
+    ("refined", 0.4),
+    ("chunked", 0.5),
+    ("indexed", 0.7),
+    ("keyword_indexed", 0.8),
+    ("ready", 1.0),
+]
+ACCURATE_SLOWDOWN = 3.0  # "accurate" mode takes this many times longer than "fast"
+CHUNK_SIZE = 800  # characters
+BM25_K1 = 1.2
+BM25_B = 0.75
+VECTOR_DIM = 1024  # hashed character trigram buckets
+RRF_K = 60
+
+
+def tokenize(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+def split_chunks(text: str, chunk_size: int = CHUNK_SIZE) -> List[str]:
+    """Greedily pack paragraphs into chunks of at most chunk_size characters."""
+    chunks, current = [], ""
+    for paragraph in (p.strip() for p in re.split(r"\n\s*\n", text)):
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) + 2 > chunk_size:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def embed(text: str) -> Dict[int, float]:
+    """Unit-normalised sparse vector of hashed character trigrams; tolerant of inflections and typos."""
+    text = f" {' '.join(tokenize(text))} "
+    counts = Counter(hash(text[i:i + 3]) % VECTOR_DIM for i in range(len(text) - 2))
+    norm = math.sqrt(sum(value * value for value in counts.values())) or 1.0
+    return {bucket: value / norm for bucket, value in counts.items()}
+
+
+class IndexedChunk:
+    def __init__(self, document: Dict, index: int, text: str):
+        self.document = document
+        self.index = index
+        self.text = text
+        terms = tokenize(text)
+        self.term_counts = Counter(terms)
+        self.length = len(terms)
+        self.vector = embed(text)
+
+
+class MockRagieState:
+    """In-memory documents and chunks, shared by all request handler threads."""
+
+    def __init__(self, index_seconds: float = 2.0, chars_per_second: float = 50000.0, retrieval: str = "hybrid",
+                 latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0, error_status: int = 503):
+        self.index_seconds = index_seconds
+        self.chars_per_second = chars_per_second
+        self.retrieval = retrieval
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.documents: Dict[str, Dict] = {}
+        self.chunks: List[IndexedChunk] = []
+        self.document_frequency: Counter = Counter()
+        self.total_length = 0
+        self.lock = threading.Lock()
+
+    def add_document(self, url: str, name: str, mode: str, metadata: Dict) -> Dict:
+        document = {
+            "id": str(uuid.uuid4()),
+            "name": name,
+            "url": url,
+            "mode": mode,
+            "metadata": metadata,
+            "created_at": time.time(),
+            "text": None,
+            "chunks": [],
+            "error": None,
+        }
+        with self.lock:
+            self.documents[document["id"]] = document
+        threading.Thread(target=self._fetch, args=(document,), daemon=True).start()
+        return self.describe(document)
+
+    def _fetch(self, document: Dict):
+        try:
+            with urlopen(document["url"], timeout=10) as response:
+                text = response.read().decode("utf-8", errors="replace")
+        except Exception as e:
+            document["error"] = str(e)
+            return
+        chunks = [IndexedChunk(document, index, chunk) for index, chunk in enumerate(split_chunks(text))]
+        with self.lock:
+            for chunk in chunks:
+                self.document_frequency.update(chunk.term_counts.keys())
+                self.total_length += chunk.length
+            self.chunks.extend(chunks)
+            document["chunks"] = chunks
+            document["text"] = text
+
+    def status(self, document: Dict) -> str:
+        if document["error"]:
+            return "failed"
+        if document["text"] is None:
+            return "pending"
+        duration = self.index_seconds + len(document["text"]) / self.chars_per_second
+        if document["mode"] == "accurate":
+            duration *= ACCURATE_SLOWDOWN
+        progress = (time.time() - document["created_at"]) / duration if duration else 1.0
+        return [status for status, start in STATUS_SCHEDULE if progress >= start][-1]
+
+    def describe(self, document: Dict) -> Dict:
+        return {
+            "id": document["id"],
+            "name": document["name"],
+            "status": self.status(document),
+            "metadata": document["metadata"],
+            "chunk_count": len(document["chunks"]),
+        }
+
+    def get_document(self, document_id: str) -> Optional[Dict]:
+        with self.lock:
+            document = self.documents.get(document_id)
+        return self.describe(document) if document else None
+
+    def inject_fault(self) -> Optional[int]:
+        """Sleep for the configured latency, then return an error status to send instead, if one is drawn."""
+        delay_ms = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+        return self.error_status if random.random() < self.error_rate else None
+
+    def _bm25_ranking(self, query: str, candidates: List[IndexedChunk], num_chunks: int,
+                      avg_length: float) -> List[IndexedChunk]:
+        scores = {}
+        for term in set(tokenize(query)):
+            document_frequency = self.document_frequency.get(term, 0)
+            if not document_frequency:
+                continue
+            idf = math.log(1 + (num_chunks - document_frequency + 0.5) / (document_frequency + 0.5))
+            for chunk in candidates:
+                frequency = chunk.term_counts.get(term, 0)
+                if frequency:
+                    norm = frequency + BM25_K1 * (1 - BM25_B + BM25_B * chunk.length / avg_length)
+                    scores[chunk] = scores.get(chunk, 0.0) + idf * frequency * (BM25_K1 + 1) / norm
+        return sorted(scores, key=scores.get, reverse=True)
+
+    def _vector_ranking(self, query: str, candidates: List[IndexedChunk]) -> List[IndexedChunk]:
+        query_vector = embed(query)
+        scores = {chunk: sum(value * chunk.vector.get(bucket, 0.0) for bucket, value in query_vector.items())
+                  for chunk in candidates}
+        return sorted((chunk for chunk in scores if scores[chunk] > 0), key=scores.get, reverse=True)
+
+    def retrieve(self, query: str, filters: Dict, top_k: int) -> List[Dict]:
+        """Rank chunks of queryable documents with BM25, trigram vectors, or both fused by reciprocal rank."""
+        with self.lock:
+            chunks = list(self.chunks)
+            num_chunks, avg_length = len(chunks), self.total_length / max(1, len(chunks))
+        candidates = [
+            chunk for chunk in chunks
+            if self.status(chunk.document) in ("indexed", "keyword_indexed", "ready")
+            and all(chunk.document["metadata"].get(key) == value for key, value in filters.items())
+        ]
+        rankings = []
+        if self.retrieval in ("bm25", "hybrid"):
+            rankings.append(self._bm25_ranking(query, candidates, num_chunks, avg_length))
+        if self.retrieval in ("vector", "hybrid"):
+            rankings.append(self._vector_ranking(query, candidates))
+        scores: Dict[IndexedChunk, float] = {}
+        for ranking in rankings:
+            for rank, chunk in enumerate(ranking):
+                scores[chunk] = scores.get(chunk, 0.0) + 1 / (RRF_K + rank + 1)
+        ranked = sorted(scores, key=scores.get, reverse=True)[:top_k]
+        return [
+            {
+                "text": chunk.text,
+                "score": round(scores[chunk] * RRF_K / len(rankings), 4),  # 1.0 for a chunk ranked first everywhere
+                "id": f"{chunk.document['id']}:{chunk.index}",
+                "index": chunk.index,
+                "document_id": chunk.document["id"],
+                "document_name": chunk.document["name"],
+                "document_metadata": chunk.document["metadata"],
+            }
+            for chunk in ranked
+        ]
+
+
+class MockRagieHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    state: MockRagieState = None
+
+    def _send(self, status: int, body: Dict, headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get("content-length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _authorized(self) -> bool:
+        if not (self.headers.get("authorization") or "").startswith("Bearer "):
+            self._send(401, {"detail": "Missing bearer token"})
+            return False
+        return True
+
+    def _fault_injected(self) -> bool:
+        error_status = self.state.inject_fault()
+        if error_status:
+            headers = {"retry-after": "1"} if error_status == 429 else {}
+            self._send(error_status, {"detail": "Injected error"}, headers)
+            return True
+        return False
+
+    def do_POST(self):
+        payload = self._read_json()
+        if not self._authorized() or self._fault_injected():
+            return
+        if self.path == "/documents/url":
+            if not payload.get("url"):
+                return self._send(422, {"detail": "url is required"})
+            document = self.state.add_document(
+                payload["url"],
+                payload.get("name") or payload["url"],
+                payload.get("mode", "fast"),
+                payload.get("metadata") or {},
+            )
+            self._send(201, document)
+        elif self.path == "/retrievals":
+            chunks = self.state.retrieve(payload.get("query", ""), payload.get("filters") or {}, payload.get("top_k", 8))
+            self._send(200, {"scored_chunks": chunks})
+        else:
+            self._send(404, {"detail": "Not found"})
+
+    def do_GET(self):
+        if not self._authorized() or self._fault_injected():
+            return
+        match = re.fullmatch(r"/documents/([\w-]+)", self.path)
+        document = self.state.get_document(match.group(1)) if match else None
+        if document:
+            self._send(200, document)
+        else:
+            self._send(404, {"detail": "Not found"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_server(host: str = "127.0.0.1", port: int = 0, **state_kwargs) -> Tuple[ThreadingHTTPServer, str]:
+    """Start the mock on a background thread and return the server and its base URL."""
+    handler = type("Handler", (MockRagieHandler,), {"state": MockRagieState(**state_kwargs)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the Ragie document and retrieval API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--index-seconds", type=float, default=2.0, help="Base time for a document to reach 'ready'")
+    parser.add_argument("--chars-per-second", type=float, default=50000.0, help="Extra indexing time per character")
+    parser.add_argument("--retrieval", choices=["hybrid", "bm25", "vector"], default="hybrid")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Added latency per request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Uniform +/- jitter on the added latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(args.host, args.port, index_seconds=args.index_seconds,
+                                         chars_per_second=args.chars_per_second, retrieval=args.retrieval,
+                                         latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                                         error_rate=args.error_rate, error_status=args.error_status)
+    print(f"Mock Ragie API listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,112 +1,355 @@
 import streamlit as st
 import requests
+import httpx
 from anthropic import Anthropic
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+import os
+import random
 import time
-from typing import List, Dict, Optional
+from typing import Iterator, List, Dict, Optional
 from urllib.parse import urlparse
 
+# HTTP client settings for the Ragie API
+RAGIE_CONNECT_TIMEOUT = 5.0  # seconds
+RAGIE_READ_TIMEOUT = 30.0  # seconds
+RAGIE_POOL_SIZE = 16  # keep-alive connections per process
+RAGIE_MAX_RETRIES = 4
+RAGIE_BACKOFF_BASE = 0.5  # seconds
+RAGIE_BACKOFF_MAX = 8.0  # seconds
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Statuses on which a non-idempotent request (an upload) is known not to have been acted on
+SAFE_RETRY_STATUS_CODES = {429}
+
+# Document ingestion settings
+RAGIE_BASE_URL = os.getenv("RAGIE_BASE_URL", "https://api.ragie.ai")  # point at mock_ragie.py to work offline
+UPLOAD_CONCURRENCY = 4
+INDEXING_TIMEOUT = 600  # seconds to wait for one document to become queryable
+POLL_INITIAL_DELAY = 0.5  # seconds
+POLL_MAX_DELAY = 5.0  # seconds
+QUERYABLE_STATUSES = {"indexed", "keyword_indexed", "summary_indexed", "ready"}
+
+# Prompt settings
+CLAUDE_MODEL = "claude-3-5-sonnet-20241022"
+MAX_OUTPUT_TOKENS = 1024
+CONTEXT_TOKEN_BUDGET = 4000  # tokens of retrieved text per prompt
+CHUNK_OVERLAP_THRESHOLD = 0.8  # drop chunks whose 5-word shingles are mostly in already packed chunks
+PROMPT_CACHE_MIN_TOKENS = 1024  # Anthropic doesn't cache shorter prefixes on Sonnet
+
+# Fixed instructions, sent as the first system block ahead of the per-query context.
+SYSTEM_INSTRUCTIONS = """These are very important to follow: You are "Ragie AI", a professional but friendly AI chatbot working as an assistant to the user. Your current task is to help the user based on all of the information available to you, which is given in the user's message between === markers as numbered excerpts, most relevant first. Answer informally, directly, and concisely without a heading or greeting but include everything relevant. Use richtext Markdown when appropriate including bold, italic, paragraphs, and lists when helpful. If using LaTeX, use double $$ as delimiter instead of single $. Use $$...$$ instead of parentheses. Organize information into multiple sections or points when appropriate. Don't include raw item IDs, excerpt numbers or other raw fields from the source. Don't use XML or other markup unless requested by the user. If the user asked for a search and there are no results, make sure to let the user know that you couldn't find anything, and what they might be able to do to find the information they need. END SYSTEM INSTRUCTIONS"""
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """
+    Full-jitter exponential backoff, honouring a Retry-After header in seconds when present.
+    """
+    if retry_after:
+        try:
+            return min(float(retry_after), RAGIE_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(RAGIE_BACKOFF_MAX, RAGIE_BACKOFF_BASE * 2 ** attempt))
+
+def create_http_session() -> requests.Session:
+    """
+    Create a keep-alive session whose connection pool is shared by every request to Ragie.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=RAGIE_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def connection_not_established(error: requests.RequestException) -> bool:
+    """
+    True when the request never reached Ragie, so even an upload can be sent again without creating a duplicate.
+    """
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """One pooled session per process, so reruns and users reuse warm TLS connections."""
+    return create_http_session()
+
+def count_tokens(text: str) -> int:
+    """Cheap token estimate (about 3 characters per token) that errs on the side of overcounting."""
+    return len(text) // 3 + 1
+
+def shingles(text: str, size: int = 5) -> set:
+    words = text.lower().split()
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+def pack_context(scored_chunks: List[Dict], token_budget: int = CONTEXT_TOKEN_BUDGET) -> List[str]:
+    """
+    Pick the highest scoring chunks that fit the token budget, skipping chunks that mostly repeat text already packed.
+    """
+    packed, packed_shingles, used_tokens = [], set(), 0
+    for chunk in sorted(scored_chunks, key=lambda chunk: chunk.get("score", 0.0), reverse=True):
+        text = chunk["text"].strip()
+        chunk_shingles = shingles(text)
+        if not text or len(chunk_shingles & packed_shingles) / len(chunk_shingles) >= CHUNK_OVERLAP_THRESHOLD:
+            continue
+        tokens = count_tokens(text)
+        if used_tokens + tokens > token_budget:
+            continue  # a lower scoring but shorter chunk may still fit
+        packed.append(text)
+        packed_shingles |= chunk_shingles
+        used_tokens += tokens
+    return packed
+
 class RAGPipeline:
-    def __init__(self, ragie_api_key: str, anthropic_api_key: str):
+    def __init__(self, ragie_api_key: str, anthropic_api_key: str, session: Optional[requests.Session] = None,
+                 base_url: str = RAGIE_BASE_URL):
         """
         Initialize the RAG pipeline with API keys.
         """
         self.ragie_api_key = ragie_api_key
         self.anthropic_api_key = anthropic_api_key
         self.anthropic_client = Anthropic(api_key=anthropic_api_key)
+        self.session = session or create_http_session()
+        self._async_clients: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
         
         # API endpoints
-        self.RAGIE_UPLOAD_URL = "https://api.ragie.ai/documents/url"
-        self.RAGIE_RETRIEVAL_URL = "https://api.ragie.ai/retrievals"
+        base_url = base_url.rstrip("/")
+        self.RAGIE_UPLOAD_URL = f"{base_url}/documents/url"
+        self.RAGIE_DOCUMENTS_URL = f"{base_url}/documents"
+        self.RAGIE_RETRIEVAL_URL = f"{base_url}/retrievals"
     
-    def upload_document(self, url: str, name: Optional[str] = None, mode: str = "fast") -> Dict:
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "accept": "application/json",
+            "content-type": "application/json",
+            "authorization": f"Bearer {self.ragie_api_key}"
+        }
+    
+    def _request(self, method: str, url: str, action: str, payload: Optional[Dict] = None,
+                 idempotent: bool = True) -> Dict:
         """
-        Upload a document to Ragie from a URL.
+        Call Ragie over the pooled session, retrying 429/5xx responses and connection errors. A request that
+        isn't idempotent (an upload) is only retried when Ragie can't have acted on it: a 429, or a connection
+        that was never established. A lost response to a POST that Ragie accepted would otherwise create a
+        duplicate document.
+        """
+        retry_statuses = RETRY_STATUS_CODES if idempotent else SAFE_RETRY_STATUS_CODES
+        for attempt in range(RAGIE_MAX_RETRIES + 1):
+            try:
+                response = self.session.request(
+                    method,
+                    url,
+                    json=payload,
+                    headers=self._headers(),
+                    timeout=(RAGIE_CONNECT_TIMEOUT, RAGIE_READ_TIMEOUT)
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == RAGIE_MAX_RETRIES or not (idempotent or connection_not_established(e)):
+                    raise
+                time.sleep(backoff_delay(attempt))
+                continue
+            if response.status_code in retry_statuses and attempt < RAGIE_MAX_RETRIES:
+                time.sleep(backoff_delay(attempt, response.headers.get("retry-after")))
+                continue
+            if not response.ok:
+                raise Exception(f"{action} failed: {response.status_code} {response.reason}")
+            return response.json()
+    
+    @property
+    def async_client(self) -> httpx.AsyncClient:
         """
+        Async client with its own keep-alive pool, for serving many retrievals concurrently. httpx ties a
+        client's connections to the event loop that opened them, so each running loop (e.g. each asyncio.run)
+        gets its own client; clients of loops that have since closed are dropped.
+        """
+        loop = asyncio.get_running_loop()
+        for closed_loop in [other for other in self._async_clients if other.is_closed()]:
+            del self._async_clients[closed_loop]
+        if loop not in self._async_clients:
+            self._async_clients[loop] = httpx.AsyncClient(
+                timeout=httpx.Timeout(RAGIE_READ_TIMEOUT, connect=RAGIE_CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=RAGIE_POOL_SIZE, max_keepalive_connections=RAGIE_POOL_SIZE)
+            )
+        return self._async_clients[loop]
+    
+    async def _arequest(self, method: str, url: str, action: str, payload: Optional[Dict] = None,
+                        idempotent: bool = True) -> Dict:
+        """
+        Async counterpart of _request with the same retry policy.
+        """
+        retry_statuses = RETRY_STATUS_CODES if idempotent else SAFE_RETRY_STATUS_CODES
+        for attempt in range(RAGIE_MAX_RETRIES + 1):
+            try:
+                response = await self.async_client.request(method, url, json=payload, headers=self._headers())
+            except (httpx.ConnectError, httpx.TimeoutException) as e:
+                # Connect and pool timeouts mean the request was never sent; read and write timeouts don't.
+                never_sent = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+                if attempt == RAGIE_MAX_RETRIES or not (idempotent or never_sent):
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+                continue
+            if response.status_code in retry_statuses and attempt < RAGIE_MAX_RETRIES:
+                await asyncio.sleep(backoff_delay(attempt, response.headers.get("retry-after")))
+                continue
+            if not response.is_success:
+                raise Exception(f"{action} failed: {response.status_code} {response.reason_phrase}")
+            return response.json()
+    
+    async def aclose(self):
+        """Close the running event loop's async client."""
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+    
+    def _upload_payload(self, url: str, name: Optional[str], mode: str, scope: str) -> Dict:
         if not name:
             name = urlparse(url).path.split('/')[-1] or "document"
             
-        payload = {
+        return {
             "mode": mode,
             "name": name,
-            "url": url
-        }
-        
-        headers = {
-            "accept": "application/json",
-            "content-type": "application/json",
-            "authorization": f"Bearer {self.ragie_api_key}"
+            "url": url,
+            "metadata": {
+                "scope": scope
+            }
         }
-        
-        response = requests.post(self.RAGIE_UPLOAD_URL, json=payload, headers=headers)
-        
-        if not response.ok:
-            raise Exception(f"Document upload failed: {response.status_code} {response.reason}")
-            
-        return response.json()
     
-    def retrieve_chunks(self, query: str, scope: str = "tutorial") -> List[str]:
-        """
-        Retrieve relevant chunks from Ragie for a given query.
-        """
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.ragie_api_key}"
-        }
-        
-        payload = {
+    def _retrieval_payload(self, query: str, scope: str) -> Dict:
+        return {
             "query": query,
             "filters": {
                 "scope": scope
             }
         }
-        
-        response = requests.post(
-            self.RAGIE_RETRIEVAL_URL,
-            headers=headers,
-            json=payload
-        )
-        
-        if not response.ok:
-            raise Exception(f"Retrieval failed: {response.status_code} {response.reason}")
-            
-        data = response.json()
+    
+    def upload_document(self, url: str, name: Optional[str] = None, mode: str = "fast", scope: str = "tutorial") -> Dict:
+        """
+        Upload a document to Ragie from a URL.
+        """
+        return self._request("POST", self.RAGIE_UPLOAD_URL, "Document upload", self._upload_payload(url, name, mode, scope),
+                             idempotent=False)
+    
+    async def aupload_document(self, url: str, name: Optional[str] = None, mode: str = "fast",
+                               scope: str = "tutorial") -> Dict:
+        """
+        Upload a document to Ragie from a URL without blocking the event loop.
+        """
+        return await self._arequest("POST", self.RAGIE_UPLOAD_URL, "Document upload",
+                                    self._upload_payload(url, name, mode, scope), idempotent=False)
+    
+    def get_document(self, document_id: str) -> Dict:
+        """
+        Fetch a document's current metadata, including its processing status.
+        """
+        return self._request("GET", f"{self.RAGIE_DOCUMENTS_URL}/{document_id}", "Document status")
+    
+    def wait_until_queryable(self, document_id: str, timeout: float = INDEXING_TIMEOUT) -> Dict:
+        """
+        Poll a document's status with exponential backoff until it can be retrieved from.
+        """
+        deadline = time.monotonic() + timeout
+        delay = POLL_INITIAL_DELAY
+        while True:
+            document = self.get_document(document_id)
+            if document["status"] in QUERYABLE_STATUSES:
+                return document
+            if document["status"] == "failed":
+                raise Exception(f"Indexing failed for document {document_id}")
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError(f"Document {document_id} not indexed after {timeout:.0f}s (status: {document['status']})")
+            time.sleep(delay)
+            delay = min(delay * 2, POLL_MAX_DELAY)
+    
+    def ingest_document(self, url: str, name: Optional[str] = None, mode: str = "fast", scope: str = "tutorial") -> Dict:
+        """
+        Upload a document and block until it is queryable.
+        """
+        document = self.upload_document(url, name, mode, scope)
+        if document.get("status") in QUERYABLE_STATUSES:
+            return document
+        return self.wait_until_queryable(document["id"])
+    
+    def ingest_documents(self, urls: List[str], mode: str = "fast", scope: str = "tutorial"):
+        """
+        Upload several documents concurrently and yield (url, document, error) as each one becomes queryable.
+        """
+        with ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY) as executor:
+            futures = {executor.submit(self.ingest_document, url, None, mode, scope): url for url in urls}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as e:
+                    yield futures[future], None, e
+    
+    def retrieve_scored_chunks(self, query: str, scope: str = "tutorial") -> List[Dict]:
+        """
+        Retrieve relevant chunks from Ragie for a given query, with their scores.
+        """
+        data = self._request("POST", self.RAGIE_RETRIEVAL_URL, "Retrieval", self._retrieval_payload(query, scope))
+        return data["scored_chunks"]
+    
+    def retrieve_chunks(self, query: str, scope: str = "tutorial") -> List[str]:
+        """
+        Retrieve relevant chunks from Ragie for a given query.
+        """
+        return [chunk["text"] for chunk in self.retrieve_scored_chunks(query, scope)]
+    
+    async def aretrieve_chunks(self, query: str, scope: str = "tutorial") -> List[str]:
+        """
+        Retrieve relevant chunks from Ragie without blocking the event loop.
+        """
+        data = await self._arequest("POST", self.RAGIE_RETRIEVAL_URL, "Retrieval", self._retrieval_payload(query, scope))
         return [chunk["text"] for chunk in data["scored_chunks"]]
 
-    def create_system_prompt(self, chunk_texts: List[str]) -> str:
+    def create_system_prompt(self) -> List[Dict]:
         """
-        Create the system prompt with the retrieved chunks.
+        Create the system prompt. It holds only the fixed instructions, so it is the stable prefix of every
+        request. It is marked for Anthropic prompt caching only once it reaches the minimum cacheable length;
+        a shorter breakpoint is never hit, and one after the per-query context would pay the cache-write
+        premium on almost every call.
         """
-        return f"""These are very important to follow: You are "Ragie AI", a professional but friendly AI chatbot working as an assistant to the user. Your current task is to help the user based on all of the information available to you shown below. Answer informally, directly, and concisely without a heading or greeting but include everything relevant. Use richtext Markdown when appropriate including bold, italic, paragraphs, and lists when helpful. If using LaTeX, use double $$ as delimiter instead of single $. Use $$...$$ instead of parentheses. Organize information into multiple sections or points when appropriate. Don't include raw item IDs or other raw fields from the source. Don't use XML or other markup unless requested by the user. Here is all of the information available to answer the user: === {chunk_texts} === If the user asked for a search and there are no results, make sure to let the user know that you couldn't find anything, and what they might be able to do to find the information they need. END SYSTEM INSTRUCTIONS"""
+        block = {"type": "text", "text": SYSTEM_INSTRUCTIONS}
+        if count_tokens(SYSTEM_INSTRUCTIONS) >= PROMPT_CACHE_MIN_TOKENS:
+            block["cache_control"] = {"type": "ephemeral"}
+        return [block]
 
-    def generate_response(self, system_prompt: str, query: str) -> str:
+    def create_user_message(self, chunk_texts: List[str], query: str) -> str:
         """
-        Generate response using Claude 3.5 Sonnet.
+        Put the packed chunks and the query after the fixed instructions.
         """
-        message = self.anthropic_client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=1024,
+        context = "\n\n".join(f"[{i}] {text}" for i, text in enumerate(chunk_texts, start=1))
+        return f"Here is all of the information available to answer the user:\n===\n{context}\n===\n\n{query}"
+
+    def generate_response(self, system_prompt: List[Dict], user_message: str) -> Iterator[str]:
+        """
+        Stream a response from Claude 3.5 Sonnet, yielding text as it arrives.
+        """
+        with self.anthropic_client.messages.stream(
+            model=CLAUDE_MODEL,
+            max_tokens=MAX_OUTPUT_TOKENS,
             system=system_prompt,
             messages=[
                 {
                     "role": "user",
-                    "content": query
+                    "content": user_message
                 }
             ]
-        )
-        
-        return message.content[0].text
+        ) as stream:
+            yield from stream.text_stream
 
-    def process_query(self, query: str, scope: str = "tutorial") -> str:
+    def process_query(self, query: str, scope: str = "tutorial") -> Iterator[str]:
         """
-        Process a query through the complete RAG pipeline.
+        Process a query through the complete RAG pipeline, streaming the answer.
         """
-        chunks = self.retrieve_chunks(query, scope)
+        chunks = pack_context(self.retrieve_scored_chunks(query, scope))
         
         if not chunks:
-            return "No relevant information found for your query."
+            yield "No relevant information found for your query."
+            return
         
-        system_prompt = self.create_system_prompt(chunks)
-        return self.generate_response(system_prompt, query)
+        yield from self.generate_response(self.create_system_prompt(), self.create_user_message(chunks, query))
 
 def initialize_session_state():
     """Initialize session state variables."""
@@ -134,7 +377,7 @@ def main():
         if st.button("Submit API Keys"):
             if ragie_key and anthropic_key:
                 try:
-                    st.session_state.pipeline = RAGPipeline(ragie_key, anthropic_key)
+                    st.session_state.pipeline = RAGPipeline(ragie_key, anthropic_key, session=get_http_session())
                     st.session_state.api_keys_submitted = True
                     st.success("API keys configured successfully!")
                 except Exception as e:
@@ -145,27 +388,37 @@ def main():
     # Document Upload Section
     if st.session_state.api_keys_submitted:
         st.markdown("### 📄 Document Upload")
-        doc_url = st.text_input("Enter document URL")
-        doc_name = st.text_input("Document name (optional)")
+        doc_urls = st.text_area("Enter document URLs (one per line)")
+        doc_name = st.text_input("Document name (optional, single URL only)")
         
         col1, col2 = st.columns([1, 3])
         with col1:
             upload_mode = st.selectbox("Upload mode", ["fast", "accurate"])
         
-        if st.button("Upload Document"):
-            if doc_url:
+        if st.button("Upload Documents"):
+            urls = [url.strip() for url in doc_urls.splitlines() if url.strip()]
+            if len(urls) == 1:
                 try:
-                    with st.spinner("Uploading document..."):
-                        st.session_state.pipeline.upload_document(
-                            url=doc_url,
+                    with st.spinner("Uploading and indexing document..."):
+                        st.session_state.pipeline.ingest_document(
+                            url=urls[0],
                             name=doc_name if doc_name else None,
                             mode=upload_mode
                         )
-                        time.sleep(5)  # Wait for indexing
                         st.session_state.document_uploaded = True
                         st.success("Document uploaded and indexed successfully!")
                 except Exception as e:
                     st.error(f"Error uploading document: {str(e)}")
+            elif urls:
+                progress = st.progress(0.0, text="Uploading and indexing documents...")
+                for done, (url, document, error) in enumerate(
+                        st.session_state.pipeline.ingest_documents(urls, mode=upload_mode), start=1):
+                    progress.progress(done / len(urls), text=f"{done}/{len(urls)} documents processed")
+                    if error:
+                        st.error(f"Error uploading {url}: {str(error)}")
+                    else:
+                        st.session_state.document_uploaded = True
+                        st.success(f"Indexed {document.get('name', url)}")
             else:
                 st.error("Please provide a document URL.")
     
@@ -177,10 +430,9 @@ def main():
         if st.button("Generate Response"):
             if query:
                 try:
+                    st.markdown("### Response:")
                     with st.spinner("Generating response..."):
-                        response = st.session_state.pipeline.process_query(query)
-                        st.markdown("### Response:")
-                        st.markdown(response)
+                        st.write_stream(st.session_state.pipeline.process_query(query))
                 except Exception as e:
                     st.error(f"Error generating response: {str(e)}")
             else:
@@ -5,16 +5,26 @@ from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_cohere import CohereEmbeddings, ChatCohere
 from langchain_qdrant import QdrantVectorStore
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams
+from qdrant_client.models import Distance, PointStruct, VectorParams
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.chains import create_retrieval_chain
 from langchain import hub
+from langchain_core.load import dumpd, load
+import json
+import time
+import threading
+import uuid
+import hashlib
+import shutil
 import tempfile
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from pathlib import Path
 from langgraph.prebuilt import create_react_agent
 from langchain_community.tools import DuckDuckGoSearchRun
 from typing import TypedDict, List
 from langchain_core.language_models import BaseLanguageModel
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langgraph.errors import GraphRecursionError
 from time import sleep
 from tenacity import retry, wait_exponential, stop_after_attempt
 
@@ -92,50 +102,140 @@ chat_model = ChatCohere(model="command-r7b-12-2024",
 
 client = init_qdrant()
 
+# Pin a hub commit with "langchain-ai/retrieval-qa-chat:<commit>"; each ref gets its own cache file.
+RETRIEVAL_QA_PROMPT = "langchain-ai/retrieval-qa-chat"
+PROMPT_CACHE_DIR = Path(os.getenv("PROMPT_CACHE_DIR", Path(tempfile.gettempdir()) / "cohere_rag_prompt_cache"))
+
+def load_prompt(prompt_ref: str):
+    """Load a LangChain Hub prompt from the local cache, pulling it from the hub only on first use."""
+    cache_path = PROMPT_CACHE_DIR / (prompt_ref.replace("/", "__").replace(":", "@") + ".json")
+    if cache_path.exists():
+        return load(json.loads(cache_path.read_text()))
+    prompt = hub.pull(prompt_ref)
+    try:
+        PROMPT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(json.dumps(dumpd(prompt), indent=2))
+    except OSError:
+        pass  # A read-only cache directory only means pulling from the hub again next time
+    return prompt
+
+@st.cache_resource
+def get_combine_docs_chain(cohere_api_key: str):
+    """Build the stuff-documents QA chain once per process and API key."""
+    return create_stuff_documents_chain(chat_model, load_prompt(RETRIEVAL_QA_PROMPT))
+
+COLLECTION_NAME = "cohere_rag"
+
+EMBED_BATCH_SIZE = 96  # Cohere's limit of texts per embed request
+UPLOAD_CONCURRENCY = 4  # Batches embedded and upserted in parallel
+MAX_PENDING_BATCHES = 2 * UPLOAD_CONCURRENCY  # Parsed batches allowed to wait for upload; bounds memory use
+CHECKPOINT_DIR = Path(tempfile.gettempdir()) / "cohere_rag_checkpoints"
+
 def process_document(file):
+    """Yield batches of chunks page by page, so a large PDF never sits fully in memory."""
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
+        tmp_file.write(file.getvalue())
+        tmp_path = tmp_file.name
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            tmp_file.write(file.getvalue())
-            tmp_path = tmp_file.name
-            
         loader = PyPDFLoader(tmp_path)
-        documents = loader.load()
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        texts = text_splitter.split_documents(documents)
-        
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, add_start_index=True)
+        batch = []
+        for page in loader.lazy_load():
+            batch.extend(text_splitter.split_documents([page]))
+            while len(batch) >= EMBED_BATCH_SIZE:
+                yield batch[:EMBED_BATCH_SIZE]
+                batch = batch[EMBED_BATCH_SIZE:]
+        if batch:
+            yield batch
+    finally:
         os.unlink(tmp_path)
-        
-        return texts
-    except Exception as e:
-        st.error(f"Error processing document: {e}")
-        return []
 
-COLLECTION_NAME = "cohere_rag"
+def chunk_point_id(doc_id: str, chunk) -> str:
+    """Content-addressed Qdrant point id from the document hash and the chunk's offset in the document, so
+    re-uploading the same PDF maps onto the same points instead of appending duplicates."""
+    offset = f"{chunk.metadata.get('page', 0)}:{chunk.metadata.get('start_index', 0)}"
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{doc_id}/{offset}"))
+
+def load_checkpoint(doc_id: str) -> set:
+    checkpoint_path = CHECKPOINT_DIR / f"{doc_id}.json"
+    return set(json.loads(checkpoint_path.read_text())) if checkpoint_path.exists() else set()
 
-def create_vector_stores(texts):
-    """Create and populate vector store with documents."""
+def save_checkpoint(doc_id: str, done_batches: set):
+    CHECKPOINT_DIR.mkdir(exist_ok=True)
+    (CHECKPOINT_DIR / f"{doc_id}.json").write_text(json.dumps(sorted(done_batches)))
+
+def clear_checkpoints():
+    """Forget all upload progress; call whenever the collection is dropped or recreated."""
+    shutil.rmtree(CHECKPOINT_DIR, ignore_errors=True)
+
+def upload_batch(doc_id: str, batch_index: int, batch) -> int:
+    """Embed the chunks of one batch that aren't in Qdrant yet and upsert them. The upsert waits until Qdrant
+    has applied the write, since the caller checkpoints the batch as stored once this returns."""
+    point_ids = [chunk_point_id(doc_id, doc) for doc in batch]
+    existing = {str(point.id) for point in client.retrieve(collection_name=COLLECTION_NAME, ids=point_ids,
+                                                           with_payload=False, with_vectors=False)}
+    new_chunks = [(point_id, doc) for point_id, doc in zip(point_ids, batch) if point_id not in existing]
+    if not new_chunks:
+        return batch_index
+    vectors = embedding.embed_documents([doc.page_content for _, doc in new_chunks])
+    points = [PointStruct(id=point_id,
+                          vector=vector,
+                          payload={"page_content": doc.page_content, "metadata": {**doc.metadata, "doc_id": doc_id}})
+              for (point_id, doc), vector in zip(new_chunks, vectors)]
+    client.upsert(collection_name=COLLECTION_NAME, points=points, wait=True)
+    return batch_index
+
+def create_vector_stores(chunk_batches, doc_id: str):
+    """Create and populate vector store from a stream of chunk batches, resuming from the last checkpoint for
+    this document. Batches are upserted as soon as they're parsed, so early pages become searchable first."""
     try:
         try:
             client.create_collection(collection_name=COLLECTION_NAME,
                                    vectors_config=VectorParams(size=1024,
                                                             distance=Distance.COSINE))
+            # A new collection (after "Clear All Data" or a restart of an in-memory Qdrant) holds none of the
+            # batches that older checkpoints recorded as stored.
+            clear_checkpoints()
             st.success(f"Created new collection: {COLLECTION_NAME}")
         except Exception as e:
             if "already exists" not in str(e).lower():
                 raise e
         
-        vector_store = QdrantVectorStore(client=client,
-                                       collection_name=COLLECTION_NAME,
-                                       embedding=embedding)
-        
-        with st.spinner('Storing documents in Qdrant...'):
-            vector_store.add_documents(texts)
-            st.success("Documents successfully stored in Qdrant!")
-        
-        return vector_store
+        done_batches = load_checkpoint(doc_id)
+        if done_batches:
+            st.info(f"Resuming upload: {len(done_batches)} batches already stored.")
+
+        status = st.empty()
+        start, pages_done, pending = time.perf_counter(), set(), {}
+
+        def collect(futures):
+            for future in futures:
+                batch_index = future.result()
+                pages_done.update(pending.pop(future))
+                done_batches.add(batch_index)
+                save_checkpoint(doc_id, done_batches)
+            pages_per_sec = len(pages_done) / (time.perf_counter() - start)
+            status.info(f"Stored {len(done_batches)} batches from {len(pages_done)} pages ({pages_per_sec:.1f} pages/s)")
+
+        with ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY) as executor:
+            for batch_index, batch in enumerate(chunk_batches):
+                if batch_index in done_batches:
+                    continue
+                # Keep only page numbers for pending batches; the chunk text is released once uploaded.
+                pending[executor.submit(upload_batch, doc_id, batch_index, batch)] = {doc.metadata.get("page") for doc in batch}
+                if len(pending) >= MAX_PENDING_BATCHES:
+                    collect(wait(pending, return_when=FIRST_COMPLETED).done)
+            collect(list(as_completed(pending)))
+        (CHECKPOINT_DIR / f"{doc_id}.json").unlink(missing_ok=True)
+        status.empty()
+        st.success(f"Documents successfully stored in Qdrant! ({len(pages_done)} pages in {time.perf_counter() - start:.1f}s)")
+
+        return QdrantVectorStore(client=client,
+                               collection_name=COLLECTION_NAME,
+                               embedding=embedding)
         
     except Exception as e:
-        st.error(f"Error in vector store creation: {str(e)}")
+        st.error(f"Error in vector store creation: {str(e)}. Upload again to resume where it stopped.")
         return None
 
 # Define the state schema using TypedDict
@@ -144,19 +244,100 @@ class AgentState(TypedDict):
     messages: List[HumanMessage | AIMessage | SystemMessage]
     is_last_step: bool
 
+SEARCH_RATE_PER_SEC = 0.5  # Sustained DuckDuckGo requests per second across all sessions
+SEARCH_BURST = 3
+SEARCH_CACHE_TTL = 900  # seconds
+SEARCH_CACHE_SIZE = 512  # Cached queries kept, least recently used dropped first
+
+class TokenBucket:
+    """Thread-safe token bucket; callers block until a token is available."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            sleep(wait_seconds)
+
+class SearchCache:
+    """TTL + LRU cache of search results. Concurrent requests for the same query share one upstream call."""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.results = OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+    def get_or_fetch(self, query: str, fetch) -> str:
+        key = " ".join(query.lower().split())
+        with self.lock:
+            cached = self.results.get(key)
+            if cached and cached[0] > time.monotonic():
+                self.results.move_to_end(key)
+                return cached[1]
+            future = self.in_flight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = self.in_flight[key] = Future()
+        if not is_owner:
+            return future.result()
+        try:
+            result = fetch(query)
+            with self.lock:
+                self.results[key] = (time.monotonic() + self.ttl, result)
+                self.results.move_to_end(key)
+                self._prune()
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+
+    def _prune(self):
+        now = time.monotonic()
+        for key in [key for key, (expires, _) in self.results.items() if expires <= now]:
+            del self.results[key]
+        while len(self.results) > self.max_size:
+            self.results.popitem(last=False)
+
+@st.cache_resource
+def get_search_limiter() -> TokenBucket:
+    return TokenBucket(rate=SEARCH_RATE_PER_SEC, capacity=SEARCH_BURST)
+
+@st.cache_resource
+def get_search_cache() -> SearchCache:
+    return SearchCache(ttl=SEARCH_CACHE_TTL, max_size=SEARCH_CACHE_SIZE)
+
 class RateLimitedDuckDuckGo(DuckDuckGoSearchRun):
+    def run(self, query: str) -> str:
+        """Run search through the shared result cache and process-wide rate limiter."""
+        return get_search_cache().get_or_fetch(query, self._limited_run)
+
     @retry(wait=wait_exponential(multiplier=1, min=4, max=10),
            stop=stop_after_attempt(3))
-    def run(self, query: str) -> str:
-        """Run search with rate limiting."""
-        try:
-            sleep(2)  # Add delay between requests
-            return super().run(query)
-        except Exception as e:
-            if "Ratelimit" in str(e):
-                sleep(5)  # Longer delay on rate limit
-                return super().run(query)
-            raise e
+    def _limited_run(self, query: str) -> str:
+        get_search_limiter().acquire()
+        return super().run(query)
+
+RESEARCH_TIME_BUDGET = 60  # seconds of wall-clock time per research run
+RESEARCH_MAX_TOOL_CALLS = 6
+RESEARCH_POLL_INTERVAL = 0.5  # seconds between progress updates while research runs
 
 def create_fallback_agent(chat_model: BaseLanguageModel):
     """Create a LangGraph agent for web research."""
@@ -164,7 +345,7 @@ def create_fallback_agent(chat_model: BaseLanguageModel):
     def web_research(query: str) -> str:
         """Web search with result formatting."""
         try:
-            search = DuckDuckGoSearchRun(num_results=5)
+            search = RateLimitedDuckDuckGo()
             results = search.run(query)
             return results
         except Exception as e:
@@ -178,6 +359,97 @@ def create_fallback_agent(chat_model: BaseLanguageModel):
     
     return agent
 
+@st.cache_resource
+def get_fallback_agent(cohere_api_key: str):
+    """Compile the research agent once per process and API key."""
+    return create_fallback_agent(chat_model)
+
+def run_research(agent, agent_input, on_step=None, cancel_event: threading.Event = None) -> tuple[str, str]:
+    """Run the agent step by step within RESEARCH_TIME_BUDGET and RESEARCH_MAX_TOOL_CALLS.
+
+    Budgets and cancel_event are checked between graph steps; when one trips, the run stops and an answer is
+    written from the search results gathered so far. Returns the answer and why the run stopped ("done",
+    "time", "tool_calls" or "cancelled"). A single slow search or model call can't be interrupted, so the run
+    can overrun RESEARCH_TIME_BUDGET by that call plus the time to write the partial answer.
+    """
+    deadline = time.monotonic() + RESEARCH_TIME_BUDGET
+    # Each tool call takes an agent step and a tool step; the limit backs up the tool-call budget.
+    config = {"recursion_limit": 2 * RESEARCH_MAX_TOOL_CALLS + 3}
+    messages, stop_reason = agent_input["messages"], "done"
+    try:
+        for state in agent.stream(agent_input, config=config, stream_mode="values"):
+            messages = state["messages"]
+            tool_calls = sum(len(getattr(message, "tool_calls", None) or []) for message in messages)
+            if on_step:
+                on_step(tool_calls)
+            if cancel_event is not None and cancel_event.is_set():
+                stop_reason = "cancelled"
+            elif time.monotonic() > deadline:
+                stop_reason = "time"
+            elif tool_calls > RESEARCH_MAX_TOOL_CALLS:
+                stop_reason = "tool_calls"
+            if stop_reason != "done":
+                break
+    except GraphRecursionError:
+        stop_reason = "tool_calls"
+
+    last_message = messages[-1]
+    if stop_reason == "done" and isinstance(last_message, AIMessage):
+        return last_message.content, stop_reason
+    findings = "\n\n".join(message.content for message in messages if isinstance(message, ToolMessage))
+    partial_prompt = (f"Answer the question '{agent_input['messages'][0].content}' using only these search results. "
+                      f"Say which parts could not be verified.\n\n{findings or 'No search results were gathered.'}")
+    return chat_model.invoke(partial_prompt).content, stop_reason
+
+class ResearchRun:
+    """
+    Runs run_research on a worker thread. A Stop click reruns the script, which would abandon research running
+    on the script thread; on a worker, the click's callback sets cancel_event and the run ends at its next step.
+    """
+
+    def __init__(self, agent, agent_input, query: str):
+        self.query = query
+        self.tool_calls = 0
+        self.answer, self.stop_reason, self.error = None, None, None
+        self.cancel_event = threading.Event()
+        self.done = threading.Event()
+        threading.Thread(target=self._run, args=(agent, agent_input), daemon=True).start()
+
+    def _run(self, agent, agent_input):
+        try:
+            self.answer, self.stop_reason = run_research(agent, agent_input, on_step=self._on_step,
+                                                         cancel_event=self.cancel_event)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+    def _on_step(self, tool_calls: int):
+        self.tool_calls = tool_calls
+
+def wait_for_research(run: ResearchRun) -> str:
+    """Show progress and a Stop button until the research run finishes, then return its formatted answer."""
+    st.session_state.research_run = run
+    with st.spinner('Researching...'):
+        if not run.cancel_event.is_set():
+            st.button("⏹️ Stop research", key="stop_research", on_click=run.cancel_event.set)
+        research_status = st.empty()
+        while not run.done.wait(RESEARCH_POLL_INTERVAL):
+            research_status.caption(f"Web searches so far: {run.tool_calls}")
+        research_status.empty()
+    st.session_state.research_run = None
+
+    if run.error is not None:
+        fallback_response = chat_model.invoke(f"Please provide a general answer to: {run.query}").content
+        return f"Web search unavailable. General response: {fallback_response}"
+    if run.stop_reason == "cancelled":
+        st.info("Research stopped; answering from the results gathered so far.")
+    elif run.stop_reason != "done":
+        st.warning("Research budget reached; answering from the results gathered so far.")
+    return f"""Comprehensive Research Results:
+{run.answer}
+"""
+
 def process_query(vectorstore, query) -> tuple[str, list]:
     """Process a query using RAG with fallback to web search."""
     try:
@@ -192,40 +464,21 @@ def process_query(vectorstore, query) -> tuple[str, list]:
         relevant_docs = retriever.get_relevant_documents(query)
 
         if relevant_docs:
-            retrieval_qa_prompt = hub.pull("langchain-ai/retrieval-qa-chat")
-            combine_docs_chain = create_stuff_documents_chain(chat_model, retrieval_qa_prompt)
-            retrieval_chain = create_retrieval_chain(retriever, combine_docs_chain)
-            response = retrieval_chain.invoke({"input": query})
-            return response['answer'], relevant_docs
+            # Answer from the documents that passed the threshold check instead of retrieving them again.
+            combine_docs_chain = get_combine_docs_chain(st.session_state.cohere_api_key)
+            answer = combine_docs_chain.invoke({"input": query, "context": relevant_docs})
+            return answer, relevant_docs
             
         else:
             st.info("No relevant documents found. Searching web...")
-            fallback_agent = create_fallback_agent(chat_model)
-            
-            with st.spinner('Researching...'):
-                agent_input = {
-                    "messages": [
-                        HumanMessage(content=f"""Please thoroughly research the question: '{query}' and provide a detailed and comprehensive response. Make sure to gather the latest information from credible sources. Minimum 400 words.""")
-                    ],
-                    "is_last_step": False
-                }
-                
-                config = {"recursion_limit": 100}
-                
-                try:
-                    response = fallback_agent.invoke(agent_input, config=config)
-                    
-                    if isinstance(response, dict) and "messages" in response:
-                        last_message = response["messages"][-1]
-                        answer = last_message.content if hasattr(last_message, 'content') else str(last_message)
-                        
-                        return f"""Comprehensive Research Results:
-{answer}
-""", []
-                    
-                except Exception as agent_error:
-                    fallback_response = chat_model.invoke(f"Please provide a general answer to: {query}").content
-                    return f"Web search unavailable. General response: {fallback_response}", []
+            fallback_agent = get_fallback_agent(st.session_state.cohere_api_key)
+            agent_input = {
+                "messages": [
+                    HumanMessage(content=f"""Please thoroughly research the question: '{query}' and provide a detailed and comprehensive response. Make sure to gather the latest information from credible sources. Minimum 400 words.""")
+                ],
+                "is_last_step": False
+            }
+            return wait_for_research(ResearchRun(fallback_agent, agent_input, query)), []
 
     except Exception as e:
         st.error(f"Error: {str(e)}")
@@ -234,12 +487,6 @@ def process_query(vectorstore, query) -> tuple[str, list]:
 def post_process(answer, sources):
     """Post-process the answer and format sources."""
     answer = answer.strip()
-
-    # Summarize long answers
-    if len(answer) > 500:
-        summary_prompt = f"Summarize the following answer in 2-3 sentences: {answer}"
-        summary = chat_model.invoke(summary_prompt).content
-        answer = f"{summary}\n\nFull Answer: {answer}"
     
     formatted_sources = []
     for i, source in enumerate(sources, 1):
@@ -247,17 +494,33 @@ def post_process(answer, sources):
         formatted_sources.append(formatted_source)
     return answer, formatted_sources
 
+def show_answer(answer, sources):
+    """Render an answer with its sources and add it to the chat history."""
+    answer, formatted_sources = post_process(answer, sources)
+    st.markdown(answer)
+    
+    if formatted_sources:
+        with st.expander("Sources"):
+            for source in formatted_sources:
+                st.markdown(source)
+    
+    st.session_state.chat_history.append({
+        "role": "assistant",
+        "content": answer
+    })
+
 st.title("RAG Agent with Cohere ⌘R")
 
 uploaded_file = st.file_uploader("Choose a PDF or Image File", type=["pdf", "jpg", "jpeg"])
 
-if uploaded_file is not None and 'processed_file' not in st.session_state:
+doc_id = hashlib.sha256(uploaded_file.getvalue()).hexdigest()[:16] if uploaded_file is not None else None
+
+if doc_id is not None and st.session_state.get('processed_file') != doc_id:
     with st.spinner('Processing file... This may take a while for images.'):
-        texts = process_document(uploaded_file)
-        vectorstore = create_vector_stores(texts)
+        vectorstore = create_vector_stores(process_document(uploaded_file), doc_id)
         if vectorstore:
             st.session_state.vectorstore = vectorstore
-            st.session_state.processed_file = True
+            st.session_state.processed_file = doc_id
             st.success('File uploaded and processed successfully!')
         else:
             st.error('Failed to process file. Please try again.')
@@ -266,6 +529,12 @@ for message in st.session_state.chat_history:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
 
+# A rerun (e.g. the Stop button) interrupts the page while research is still running on its worker thread;
+# finish rendering that run here so its answer isn't lost.
+if st.session_state.get("research_run") is not None:
+    with st.chat_message("assistant"):
+        show_answer(wait_for_research(st.session_state.research_run), [])
+
 if query := st.chat_input("Ask a question about the document:"):
     st.session_state.chat_history.append({"role": "user", "content": query})
     with st.chat_message("user"):
@@ -275,17 +544,7 @@ if query := st.chat_input("Ask a question about the document:"):
         with st.chat_message("assistant"):
             try:
                 answer, sources = process_query(st.session_state.vectorstore, query)
-                st.markdown(answer)
-                
-                if sources:
-                    with st.expander("Sources"):
-                        for source in sources:
-                            st.markdown(f"- {source.page_content[:200]}...")
-                
-                st.session_state.chat_history.append({
-                    "role": "assistant",
-                    "content": answer
-                })
+                show_answer(answer, sources)
                 
             except Exception as e:
                 st.error(f"Error: {str(e)}")
@@ -310,8 +569,10 @@ with st.sidebar:
                     client.delete_collection(COLLECTION_NAME)
                 if f"{COLLECTION_NAME}_compressed" in collection_names:
                     client.delete_collection(f"{COLLECTION_NAME}_compressed")
+                clear_checkpoints()
                 
                 st.session_state.vectorstore = None
+                st.session_state.processed_file = None
                 st.session_state.chat_history = []
                 st.success("All data cleared successfully!")
                 st.rerun()